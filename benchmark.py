@@ -0,0 +1,423 @@
+"""
+Performance checks, run from the repository directory, offline
+
+    python benchmark.py run --files 100000
+    python benchmark.py run --files 10000 --exiftool --library-index
+    python benchmark.py startup --files 50
+    python benchmark.py verify --files 1000
+
+run generates a synthetic library (EXIF JPEGs, MOV/MP4 headers, PDFs with a date in their text and
+scans for the vision model, with name collisions and exact copies), serves the vision requests from
+a local fake OpenAI server and reports files/sec, peak RSS and the time spent per stage.
+"""
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# only needed once a file is sent to the vision model
+HEAVY_MODULES = ["openai", "PIL", "pdf2image", "PyPDF2"]
+
+# runs in a fresh interpreter, so sys.modules only holds what the run imported
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from pathlib import Path
+from media_renamer import MediaRenamer
+imported = time.perf_counter()
+renamer = MediaRenamer(simulate=True, use_cache=False, log_callback=lambda message: None)
+renamer.process_directory(Path(sys.argv[1]), Path(sys.argv[1]))
+done = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "run": done - imported,
+    "files": len(renamer.renamed_files),
+    "modules": len(sys.modules),
+    "heavy_modules": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def exif_jpeg(date: datetime, payload: bytes = b"") -> bytes:
+    """Smallest JPEG header exiftool and fast_metadata read a DateTimeOriginal from, no image data"""
+    value = date.strftime("%Y:%m:%d %H:%M:%S").encode() + b"\x00"
+    # IFD0 holds the pointer to the EXIF IFD, which holds the date right after it
+    tiff = b"II*\x00" + struct.pack("<I", 8)
+    tiff += struct.pack("<HHHII", 1, 0x8769, 4, 1, 26) + struct.pack("<I", 0)
+    tiff += struct.pack("<HHHII", 1, 0x9003, 2, len(value), 44) + struct.pack("<I", 0)
+    tiff += value
+
+    exif = b"Exif\x00\x00" + tiff
+    data = b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+    if payload:
+        data += b"\xff\xfe" + struct.pack(">H", len(payload) + 2) + payload
+    return data + b"\xff\xd9"
+
+
+def atom(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def quicktime(date: datetime, brand: bytes = b"qt  ", creation_date: str = None, payload: bytes = b"") -> bytes:
+    """MOV/MP4 with an mvhd creation time, and the Apple creation date key when given, no media data"""
+    seconds = int((date - datetime(1904, 1, 1)).total_seconds())
+    parts = [atom(b"mvhd", b"\x00\x00\x00\x00" + struct.pack(">II", seconds, seconds) + b"\x00" * 88)]
+    if creation_date:
+        key = b"com.apple.quicktime.creationdate"
+        keys = atom(b"keys", b"\x00" * 4 + struct.pack(">I", 1) + struct.pack(">I4s", 8 + len(key), b"mdta") + key)
+        data = atom(b"data", struct.pack(">II", 1, 0) + creation_date.encode())
+        items = atom(b"ilst", struct.pack(">I", 8 + len(data)) + struct.pack(">I", 1) + data)
+        handler = atom(b"hdlr", b"\x00" * 8 + b"mdta" + b"\x00" * 13)
+        parts.append(atom(b"meta", handler + keys + items))
+    return atom(b"ftyp", brand + b"\x00" * 4 + brand) + atom(b"mdat", payload) + atom(b"moov", b"".join(parts))
+
+
+def text_pdf(text: str) -> bytes:
+    """One page PDF with the text in its text layer"""
+    stream = f"BT /F1 24 Tf 72 700 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, content in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n".encode() + content + b"\nendobj\n"
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        data += f"{offset:010d} 00000 n \n".encode()
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(data)
+
+
+def make_file(kind: str, date: datetime, payload: bytes) -> tuple:
+    """(extension, content) of a synthetic file of the kind, dated date"""
+    if kind == "jpeg" or kind == "scan":
+        # the date of scans comes from the fake vision model, the EXIF date is ignored
+        return ".jpg", exif_jpeg(date, payload)
+    if kind == "mov":
+        return ".mov", quicktime(date, b"qt  ", date.strftime("%Y-%m-%dT%H:%M:%S+0000"), payload)
+    if kind == "mp4":
+        return ".mp4", quicktime(date, b"mp42", payload=payload)
+    if kind == "pdf":
+        return ".pdf", text_pdf(f"Document {payload.hex()[:16]} Data: {date:%Y-%m-%d %H:%M}")
+    raise ValueError(f"Unknown kind: {kind}")
+
+
+# share of each kind of file in the library, scans and PDFs go to the vision directory
+MIX = [("jpeg", 0.70), ("mov", 0.08), ("mp4", 0.07), ("scan", 0.10), ("pdf", 0.05)]
+
+
+def generate_tree(root: str, files: int, collisions: float = 0.02, copies: float = 0.02, payload_size: int = 2048,
+                  per_directory: int = 1000, seed: int = 0) -> dict:
+    """
+    Write a synthetic media library to root and return the number of files per kind
+
+    Photos and videos go to root/media, scans and PDFs to root/scans. A share of the files reuses
+    the date of the previous file with other content (a name collision) or is an exact copy of it.
+    The same seed always produces the same library.
+    """
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX)
+    counts = { kind: 0 for kind in kinds }
+    counts.update(collisions=0, copies=0)
+    base = datetime(2015, 1, 1)
+    previous = None
+    created = set()
+
+    for index in range(files):
+        roll = rng.random()
+        if previous is not None and roll < copies:
+            kind, date, extension, content = previous
+            counts["copies"] += 1
+        else:
+            if previous is not None and roll < copies + collisions:
+                kind, date = previous[0], previous[1]
+                counts["collisions"] += 1
+            else:
+                kind = rng.choices(kinds, weights)[0]
+                date = base + timedelta(seconds=index * 97)
+            # sizes vary like real files do, files of the same size are compared by content
+            extension, content = make_file(kind, date, rng.randbytes(rng.randint(payload_size // 2, payload_size * 3 // 2)))
+        counts[kind] += 1
+        previous = (kind, date, extension, content)
+
+        directory = os.path.join(root, "scans" if kind in ("scan", "pdf") else "media", f"{index // per_directory:05d}")
+        if directory not in created:
+            os.makedirs(directory, exist_ok=True)
+            created.add(directory)
+        with open(os.path.join(directory, f"file_{index:07d}{extension}"), "wb") as file:
+            file.write(content)
+
+    return counts
+
+
+class FakeOpenAI:
+    """
+    Local stand-in for the chat completions endpoint
+
+    Answers every request with a date derived from the image it was sent, after latency seconds,
+    so identical files get the same date and the run needs no network.
+    """
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with fake._lock:
+                    fake.requests += 1
+                time.sleep(fake.latency)
+
+                seconds = int(hashlib.md5(body).hexdigest()[:8], 16) % (10 * 365 * 86400)
+                answer = (datetime(2015, 1, 1) + timedelta(seconds=seconds)).strftime("%Y%m%d_%H%M%S")
+                response = json.dumps({
+                    "id": "benchmark",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": "gpt-4o",
+                    "choices": [{ "index": 0, "message": { "role": "assistant", "content": answer }, "finish_reason": "stop" }],
+                    "usage": { "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0 },
+                }).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-openai", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def peak_rss() -> dict:
+    """Peak resident memory in MB of this process and of the finished child processes, e.g. exiftool"""
+    if resource is None:
+        return {}
+    # kilobytes on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def run(files: int = 1000, workers: int = None, exiftool: bool = False, simulate: bool = False, library_index: bool = False,
+        repeat: bool = False, latency: float = 0.05, directory: str = None, seed: int = 0, **options) -> dict:
+    """Generate a library, rename it with process_directory and report the throughput and the time per stage"""
+    from pathlib import Path
+    from config import SearchType
+    from media_renamer import MediaRenamer
+
+    errors = []
+
+    def log(message: str):
+        if message.startswith("ERROR"):
+            errors.append(message)
+
+    with tempfile.TemporaryDirectory(dir=directory) as root, FakeOpenAI(latency) as server:
+        tree = os.path.join(root, "library")
+        state = os.path.join(root, "state")
+        os.makedirs(state)
+
+        start = time.perf_counter()
+        counts = generate_tree(tree, files, seed=seed, **options)
+        generated = time.perf_counter() - start
+
+        # the vision stack talks to the fake server, the raw files are sent as they are
+        os.environ["OPENAI_BASE_URL"] = server.url
+        os.environ["OPENAI_API_KEY"] = "benchmark"
+        scans = { "search": SearchType.Image, "directory_pattern": "%Y/%Y-%m-%d", "file_pattern": "%Y%m%d_%H%M%S_%f",
+                  "vision": { "preprocess": False } }
+
+        renamer = MediaRenamer(
+            simulate=simulate,
+            create_sub_directories=True,
+            special_directories={ os.path.join(tree, "scans"): scans },
+            log_callback=log,
+            cache_path=os.path.join(state, "cache.sqlite"),
+            fast_metadata=not exiftool,
+            use_library_index=library_index,
+            index_path=os.path.join(state, "index.sqlite")
+        )
+
+        runs = []
+        for attempt in range(2 if repeat else 1):
+            # a repeated run goes over the renamed library with a warm cache
+            for name in ("media", "scans"):
+                # like a scans directory would be set up, its files are renamed within it
+                directory = Path(tree, name)
+                requests, hits = server.requests, renamer.cache.hits
+                renamer.process_directory(directory, directory, recursive=True, max_workers=workers)
+                summary = renamer.metrics.summary()
+                runs.append({
+                    "run": attempt + 1,
+                    "directory": name,
+                    "files_per_second": summary["files_per_second"],
+                    "elapsed": summary["elapsed"],
+                    "outcomes": summary["outcomes"],
+                    "stages": summary["stages"],
+                    "gauges": summary["gauges"],
+                    "vision_requests": server.requests - requests,
+                    "cache_hits": renamer.cache.hits - hits,
+                })
+
+    return {
+        "files": files,
+        "generated": counts,
+        "generate_seconds": generated,
+        "runs": runs,
+        "peak_rss_mb": peak_rss(),
+        "errors": len(errors),
+        "first_errors": errors[:10],
+    }
+
+
+def verify(files: int = 1000, directory: str = None, seed: int = 0) -> list:
+    """Compare the tags fast_metadata reads natively with what exiftool reports, returns the differences"""
+    from fast_metadata import compare
+
+    with tempfile.TemporaryDirectory() as root:
+        if directory is None:
+            directory = root
+            generate_tree(root, files, seed=seed)
+
+        file_paths = [os.path.join(path, name) for path, _, names in os.walk(directory) for name in names]
+        return compare(file_paths)
+
+
+def startup(files: int = 20) -> dict:
+    """Time an EXIF-only simulated run in a fresh interpreter and list the heavy modules it imported"""
+    repository = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        date = datetime(2021, 1, 1)
+        for index in range(files):
+            with open(os.path.join(directory, f"image_{index}.jpg"), "wb") as file:
+                file.write(exif_jpeg(date + timedelta(minutes=index)))
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        interpreter = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, directory, *HEAVY_MODULES],
+            cwd=repository, capture_output=True, text=True, check=True
+        )
+        total = time.perf_counter() - start
+
+    stats = json.loads(result.stdout.splitlines()[-1])
+    stats["interpreter"] = interpreter
+    stats["total"] = total
+    return stats
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Performance checks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("run", help="rename a synthetic library end to end")
+    command.add_argument("--files", type=int, default=1000, help="from 1k to 1M")
+    command.add_argument("--workers", type=int)
+    command.add_argument("--exiftool", action="store_true", help="read all metadata with the real exiftool")
+    command.add_argument("--simulate", action="store_true", help="don't move the files")
+    command.add_argument("--library-index", action="store_true")
+    command.add_argument("--repeat", action="store_true", help="run a second time with a warm cache")
+    command.add_argument("--latency", type=float, default=0.05, help="seconds the fake vision model takes to answer")
+    command.add_argument("--collisions", type=float, default=0.02, help="share of files with the date of another")
+    command.add_argument("--copies", type=float, default=0.02, help="share of files that are copies of another")
+    command.add_argument("--payload-size", type=int, default=2048, help="average random bytes per file")
+    command.add_argument("--directory", help="where the library is generated, defaults to the temporary directory")
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--output", help="also write the report to this file")
+
+    command = commands.add_parser("startup", help="check an EXIF-only run doesn't import the vision stack")
+    command.add_argument("--files", type=int, default=20)
+
+    command = commands.add_parser("verify", help="compare the natively read metadata with exiftool")
+    command.add_argument("--files", type=int, default=1000)
+    command.add_argument("--directory", help="check these files instead of a synthetic library")
+    command.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        report = run(
+            files=args.files,
+            workers=args.workers,
+            exiftool=args.exiftool,
+            simulate=args.simulate,
+            library_index=args.library_index,
+            repeat=args.repeat,
+            latency=args.latency,
+            directory=args.directory,
+            seed=args.seed,
+            collisions=args.collisions,
+            copies=args.copies,
+            payload_size=args.payload_size
+        )
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+        return 1 if report["errors"] else 0
+
+    if args.command == "verify":
+        try:
+            differences = verify(args.files, args.directory, args.seed)
+        except FileNotFoundError as e:
+            print(f"ERROR: verify needs exiftool: {e}")
+            return 2
+        for difference in differences:
+            print(json.dumps(difference))
+        print(f"{len(differences)} differences")
+        return 1 if differences else 0
+
+    if args.command == "startup":
+        stats = startup(args.files)
+        print(json.dumps(stats, indent=2))
+        if stats["heavy_modules"]:
+            print(f"FAIL: an EXIF-only run imported {', '.join(stats['heavy_modules'])}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Command line entry point, for cron jobs and containers without a display
+
+    python -m cli rename /photos --recursive --sub-directories
+    python -m cli rename /photos --recursive --plan /tmp/photos.plan
+    python -m cli apply /tmp/photos.plan
+    python -m cli rollback /tmp/photos.plan.journal
+    python -m cli --log-file /var/log/renamer.log watch /incoming --recursive --daemon --pid-file /run/renamer.pid
+"""
+from pathlib import Path
+import argparse
+import os
+import signal
+import sys
+
+# what --quiet leaves out, one line per file
+PER_FILE_MESSAGES = ("RENAME:", "DELETE:", "INVALID:", "DUPLICATE:", "SKIP:", "RESTORE:")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Renames media by production date")
+    parser.add_argument("--quiet", action="store_true", help="don't print a line per file")
+    parser.add_argument("--log-file", help="append the messages to this file instead of printing them")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rename = commands.add_parser("rename", help="rename the files of a directory")
+    rename.add_argument("--plan", dest="plan_path", help="write the moves to this file instead of making them, see apply")
+    rename.add_argument("--metrics", dest="metrics_path", help="write the time per stage and the throughput as JSON")
+    rename.add_argument("--profile", dest="profile_path", help="write sampled stacks of every thread, for flame graphs")
+
+    watch = commands.add_parser("watch", help="rename the files added to a directory as they arrive")
+    watch.add_argument("--settle", type=float, default=2.0,
+                       help="seconds a file must stay unchanged before it is renamed")
+    watch.add_argument("--poll", dest="use_inotify", action="store_false",
+                       help="rescan the directory instead of using inotify, for network shares")
+    watch.add_argument("--poll-interval", type=float, default=5.0)
+    watch.add_argument("--daemon", action="store_true", help="detach from the terminal, see --log-file")
+    watch.add_argument("--pid-file")
+
+    for command in (rename, watch):
+        command.add_argument("directory", type=Path)
+        command.add_argument("--working-directory", type=Path, help="where renamed files go, defaults to the directory")
+        command.add_argument("--recursive", action="store_true")
+        command.add_argument("--simulate", action="store_true", help="only log what would be done")
+        command.add_argument("--sub-directories", dest="create_sub_directories", action="store_true",
+                             help="create sub-directories from the directory pattern")
+        command.add_argument("--delete-empty-directories", action="store_true")
+        command.add_argument("--invalid-as-file-date", action="store_true",
+                             help="use the file date for files without a date instead of moving them to invalid")
+        command.add_argument("--no-dst", dest="apply_dst", action="store_false",
+                             help="don't apply daylight savings for misbehaved videos")
+        command.add_argument("--workers", type=int, help="worker threads, defaults to the number of cores")
+        command.add_argument("--batch-size", type=int, default=200)
+        command.add_argument("--queue-size", type=int, default=10000)
+        command.add_argument("--flush-interval", type=float, default=1.0)
+        command.add_argument("--no-fast-metadata", dest="fast_metadata", action="store_false",
+                             help="always read the metadata with exiftool")
+        command.add_argument("--vision-concurrency", type=int, default=8)
+        command.add_argument("--vision-requests-per-minute", type=int)
+        command.add_argument("--vision-tokens-per-minute", type=int)
+        command.add_argument("--library-index", dest="use_library_index", action="store_true",
+                             help="look for copies of each file anywhere in the working directory")
+        command.add_argument("--index-path")
+        command.add_argument("--copy-workers", type=int, default=4, help="parallel copies across devices")
+        command.add_argument("--verify-copies", action="store_true", help="compare copies across devices with their source")
+
+    apply = commands.add_parser("apply", help="make the moves of a plan, resuming an interrupted apply")
+    apply.add_argument("plan_path")
+    apply.add_argument("--journal", dest="journal_path", help="defaults to the plan path with .journal appended")
+    apply.add_argument("--batch-size", type=int, default=500)
+    apply.add_argument("--copy-workers", type=int, default=4)
+    apply.add_argument("--verify-copies", action="store_true")
+
+    rollback = commands.add_parser("rollback", help="move the files of an applied plan back")
+    rollback.add_argument("journal_path")
+
+    for command in (rename, watch, apply, rollback):
+        command.add_argument("--no-cache", dest="use_cache", action="store_false", help="don't use the result cache")
+        command.add_argument("--cache-path")
+        command.add_argument("--cache-max-entries", type=int, default=1000000)
+
+    return parser
+
+
+def daemonize():
+    """Detach from the terminal and the session, the classic double fork"""
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    # the working directory is kept, relative paths in the arguments and the config still resolve
+    os.umask(0o022)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(null, fd)
+    os.close(null)
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    from dotenv import load_dotenv
+    from config import config
+    from media_renamer import MediaRenamer
+
+    # Load environment variables
+    load_dotenv()
+
+    if args.command == "watch" and args.daemon:
+        # before any thread is started, they don't survive fork
+        daemonize()
+    if args.command == "watch" and args.pid_file:
+        with open(args.pid_file, "w") as file:
+            file.write(f"{os.getpid()}\n")
+
+    output = open(args.log_file, "a", encoding="utf-8") if args.log_file else sys.stdout
+
+    def log(message: str):
+        if not (args.quiet and message.startswith(PER_FILE_MESSAGES)):
+            print(message, file=output, flush=True)
+
+    options = {
+        "log_callback": log,
+        "special_directories": config["special_directories"],
+        "use_cache": args.use_cache,
+        "cache_path": args.cache_path,
+        "cache_max_entries": args.cache_max_entries,
+    }
+
+    if args.command in ("rename", "watch"):
+        # absolute from here on, so the scanned paths, the targets and the library index agree
+        args.directory = Path(os.path.abspath(args.directory))
+        args.working_directory = Path(os.path.abspath(args.working_directory or args.directory))
+        options.update(
+            create_sub_directories=args.create_sub_directories,
+            delete_empty_directories=args.delete_empty_directories,
+            invalid_as_file_date=args.invalid_as_file_date,
+            apply_dst=args.apply_dst,
+            batch_size=args.batch_size,
+            queue_size=args.queue_size,
+            flush_interval=args.flush_interval,
+            fast_metadata=args.fast_metadata,
+            vision_concurrency=args.vision_concurrency,
+            vision_requests_per_minute=args.vision_requests_per_minute,
+            vision_tokens_per_minute=args.vision_tokens_per_minute,
+            use_library_index=args.use_library_index,
+            index_path=args.index_path,
+            copy_workers=args.copy_workers,
+            verify_copies=args.verify_copies
+        )
+
+    if args.command == "rename":
+        renamer = MediaRenamer(
+            **options,
+            # a plan is only a plan if nothing is moved
+            simulate=args.simulate or args.plan_path is not None,
+            plan_path=args.plan_path,
+            metrics_path=args.metrics_path,
+            profile_path=args.profile_path
+        )
+        renamer.process_directory(
+            args.directory,
+            args.working_directory,
+            recursive=args.recursive,
+            max_workers=args.workers
+        )
+    elif args.command == "watch":
+        from watcher import Watcher
+
+        watcher = Watcher(
+            MediaRenamer(**options, simulate=args.simulate),
+            args.directory,
+            args.working_directory,
+            recursive=args.recursive,
+            settle=args.settle,
+            poll_interval=args.poll_interval,
+            use_inotify=args.use_inotify,
+            max_workers=args.workers
+        )
+        for number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(number, lambda *_: watcher.stop())
+        try:
+            watcher.run()
+        finally:
+            if args.pid_file:
+                os.unlink(args.pid_file)
+    elif args.command == "apply":
+        renamer = MediaRenamer(**options, simulate=False, copy_workers=args.copy_workers, verify_copies=args.verify_copies)
+        stats = renamer.apply_plan(args.plan_path, args.journal_path, args.batch_size)
+        if stats["missing"] or stats["conflict"]:
+            return 1
+    elif args.command == "rollback":
+        MediaRenamer(**options, simulate=False).rollback_plan(args.journal_path)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,5 +5,9 @@ SearchType = Enum("SearchType", "Exif Image FileSystem")
 config = {
     "special_directories": {
         "/some/path": { "search": SearchType.Image, "directory_pattern": "%Y-%Y-%m-%d", "file_pattern": "%Y%m%d_%H%M%S_%f" },
+        "/some/scans": { "search": SearchType.Image, "directory_pattern": "%Y-%Y-%m-%d", "file_pattern": "%Y%m%d_%H%M%S_%f",
+                         "vision": { "max_dimension": 1600, "jpeg_quality": 80, "crop_top": 0.3 } },
     },
+    # optional file the desktop app writes the full log to, its window only keeps the last lines
+    # "log_file": "/some/path/media_rename.log",
 }
\ No newline at end of file
@@ -0,0 +1,94 @@
+from datetime import datetime
+import os
+import threading
+from config import SearchType
+from preprocess import DEFAULT_PREPROCESS
+
+REQUIRED_KEYS = ["search", "directory_pattern", "file_pattern"]
+OPTIONAL_KEYS = ["vision"]
+
+# parent directories remembered, a new run starts over when there are more
+MEMO_LIMIT = 100000
+
+
+def validate_config(directory: str, config: dict):
+    """Raise a ValueError describing the first problem with the config of a special directory"""
+    if not isinstance(config, dict):
+        raise ValueError(f"Config of {directory} must be a dict, not {type(config).__name__}")
+
+    missing = [key for key in REQUIRED_KEYS if key not in config]
+    if missing:
+        raise ValueError(f"Config of {directory} is missing {', '.join(missing)}")
+    unknown = [key for key in config if key not in REQUIRED_KEYS + OPTIONAL_KEYS]
+    if unknown:
+        raise ValueError(f"Config of {directory} has unknown keys {', '.join(map(str, unknown))}")
+
+    if not isinstance(config["search"], SearchType):
+        raise ValueError(f"Config of {directory}: search must be a SearchType, not {config['search']!r}")
+    for key in ["directory_pattern", "file_pattern"]:
+        try:
+            datetime(2000, 1, 1).strftime(config[key])
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Config of {directory}: invalid {key} {config[key]!r}: {e}")
+
+    vision = config.get("vision")
+    if vision is not None:
+        if not isinstance(vision, dict):
+            raise ValueError(f"Config of {directory}: vision must be a dict")
+        unknown = [key for key in vision if key not in DEFAULT_PREPROCESS]
+        if unknown:
+            raise ValueError(f"Config of {directory}: unknown vision options {', '.join(map(str, unknown))}")
+
+
+def path_components(path) -> list:
+    path = os.path.normcase(os.path.abspath(os.fspath(path)))
+    return [component for component in path.split(os.sep) if component]
+
+
+class DirectoryConfigs:
+    """
+    The special directories compiled into a trie of path components
+
+    The config of a file is the one of the deepest special directory containing it, found in
+    O(depth) whatever the number of special directories, and remembered per parent directory so
+    the files of a directory share a single lookup. Configs are validated when compiled.
+    """
+
+    def __init__(self, special_directories: dict, default: dict):
+        self.default = default
+        # each node is { component: node }, the config of a special directory is stored under None
+        self._root = {}
+        self._memo = {}
+        self._lock = threading.Lock()
+
+        for directory, config in special_directories.items():
+            validate_config(directory, config)
+            node = self._root
+            for component in path_components(directory):
+                node = node.setdefault(component, {})
+            if None in node:
+                raise ValueError(f"Directory {directory} is configured twice")
+            node[None] = config
+
+    def lookup(self, directory) -> dict:
+        """Config of the files in directory"""
+        node = self._root
+        config = node.get(None, self.default)
+        for component in path_components(directory):
+            node = node.get(component)
+            if node is None:
+                break
+            config = node.get(None, config)
+        return config
+
+    def match(self, file_path) -> dict:
+        """Config of a file"""
+        directory = os.path.dirname(os.fspath(file_path))
+        config = self._memo.get(directory)
+        if config is None:
+            config = self.lookup(directory)
+            with self._lock:
+                if len(self._memo) >= MEMO_LIMIT:
+                    self._memo.clear()
+                self._memo[directory] = config
+        return config
@@ -0,0 +1,80 @@
+import errno
+import os
+import threading
+
+
+class DirectoryManager:
+    """
+    Keeps track of the directories of a run: how many entries the scanned ones hold and which exist
+
+    The scan records the number of entries of each directory, moves and created directories keep
+    the counts up to date, so empty directories are found without listing them again and pruned
+    bottom-up in one pass, parents emptied by the removal of their children included. Target
+    directories are created at most once per run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._known = set()
+
+    def scanned(self, directory: str, entries: int):
+        with self._lock:
+            self._counts[directory] = entries
+            self._known.add(directory)
+
+    def _add(self, directory: str, count: int):
+        if directory in self._counts:
+            self._counts[directory] += count
+
+    def makedirs(self, directory: str, simulate: bool = False):
+        """Create directory and its missing parents, in simulations only count them"""
+        with self._lock:
+            if directory in self._known:
+                return
+
+            missing = []
+            current = directory
+            while current not in self._known and not os.path.isdir(current):
+                missing.append(current)
+                parent = os.path.dirname(current)
+                if parent == current:
+                    break
+                current = parent
+
+            not simulate and os.makedirs(directory, exist_ok=True)
+            for created in missing:
+                # a new directory is a new entry of its parent
+                self._add(os.path.dirname(created), 1)
+            self._known.update(missing)
+            self._known.add(directory)
+
+    def moved(self, source: str, target: str):
+        with self._lock:
+            self._add(os.path.dirname(source), -1)
+            self._add(os.path.dirname(target), 1)
+
+    def prune(self, directories: list, simulate: bool = False, log: callable = print) -> list:
+        """Remove the directories left empty, deepest first, and return them"""
+        removed = []
+        with self._lock:
+            for directory in sorted(directories, key=lambda path: path.count(os.sep), reverse=True):
+                if self._counts.get(directory) != 0:
+                    continue
+                if not simulate:
+                    try:
+                        os.rmdir(directory)
+                    except OSError as e:
+                        # something was added behind our back...leave it
+                        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                            log(f"ERROR deleting empty directory {directory}: {e}")
+                        continue
+                removed.append(directory)
+                self._known.discard(directory)
+                self._add(os.path.dirname(directory), -1)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._known.clear()
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+from result_cache import sample_digest
+
+
+class DuplicateDetector:
+    """
+    Decides whether two files have the same content, reading as little of them as possible
+
+    Sizes are compared first, then a digest of the first and last blocks, and only then the
+    digest of the whole file, read in fixed-size chunks. Digests are remembered per path, size
+    and modification time, so each file is hashed at most once per run.
+    """
+
+    def __init__(self, algorithm: str = "md5", sample_size: int = 65536, chunk_size: int = 1048576):
+        # md5 matches the names of the files already moved to the "duplicates" directories
+        self.algorithm = algorithm
+        self.sample_size = sample_size
+        self.chunk_size = chunk_size
+
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._digests = {}
+
+    @staticmethod
+    def _key(file_path: str) -> tuple:
+        stat = os.stat(file_path)
+        return file_path, stat.st_size, stat.st_mtime_ns
+
+    def sample(self, file_path: str) -> str:
+        key = self._key(file_path)
+        with self._lock:
+            if key in self._samples:
+                return self._samples[key]
+
+        value = sample_digest(file_path, key[1], self.sample_size)
+        with self._lock:
+            self._samples[key] = value
+        return value
+
+    def digest(self, file_path: str) -> str:
+        key = self._key(file_path)
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+
+        digest = hashlib.new(self.algorithm)
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(self.chunk_size), b""):
+                digest.update(chunk)
+        value = digest.hexdigest()
+
+        with self._lock:
+            self._digests[key] = value
+        return value
+
+    def same_content(self, first: str, second: str) -> bool:
+        if os.path.samefile(first, second):
+            return True
+
+        size = os.path.getsize(first)
+        if size != os.path.getsize(second):
+            return False
+
+        # the sample already covers small files completely
+        if size > 2 * self.sample_size and self.sample(first) != self.sample(second):
+            return False
+
+        return self.digest(first) == self.digest(second)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._digests.clear()
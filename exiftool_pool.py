@@ -0,0 +1,101 @@
+import exiftool
+from exiftool.exceptions import ExifToolExecuteError
+from contextlib import contextmanager
+import queue
+import threading
+
+
+class ExifToolPool:
+    """Bounded pool of long-lived exiftool processes (-stay_open) shared by all resolvers"""
+
+    def __init__(self, size: int = 1):
+        self.size = max(1, size or 1)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._sessions = []
+
+    def _create(self) -> exiftool.ExifToolHelper:
+        session = exiftool.ExifToolHelper()
+        session.run()
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def _discard(self, session: exiftool.ExifToolHelper):
+        try:
+            session.terminate()
+        except Exception:
+            pass
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            self._created -= 1
+
+    def _acquire(self) -> exiftool.ExifToolHelper:
+        with self._lock:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            # all sessions are busy, wait for one to be returned
+            return self._idle.get()
+        try:
+            return self._create()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def session(self):
+        """Borrow a running exiftool session, restarting it if the process died"""
+        session = self._acquire()
+        try:
+            if not session.running:
+                session.run()
+            yield session
+        except ExifToolExecuteError:
+            # exiftool reported an error for the files, the process itself is fine
+            self._idle.put(session)
+            raise
+        except Exception:
+            # the process may have crashed or be out of sync...replace it
+            self._discard(session)
+            raise
+        else:
+            self._idle.put(session)
+
+    def get_metadata(self, files, params=None) -> list:
+        with self.session() as session:
+            return session.get_metadata(files, params=params)
+
+    def get_tags(self, files, tags, params=None) -> list:
+        with self.session() as session:
+            return session.get_tags(files, tags, params=params)
+
+    def shutdown(self):
+        with self._lock:
+            sessions = list(self._sessions)
+            self._sessions.clear()
+            self._created = 0
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        for session in sessions:
+            try:
+                session.terminate()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
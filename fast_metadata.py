@@ -0,0 +1,334 @@
+from datetime import datetime, timedelta
+import argparse
+import os
+import re
+import struct
+import sys
+
+# only the header of the file is read...JPEG metadata segments all come before the image data
+JPEG_HEADER_LIMIT = 1024 * 1024
+PNG_CHUNK_LIMIT = 64 * 1024 * 1024
+ATOM_READ_LIMIT = 1024 * 1024
+
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+QUICKTIME_BRANDS = {
+    b"qt  ": "MOV",
+    b"isom": "MP4", b"iso2": "MP4", b"iso4": "MP4", b"iso5": "MP4", b"iso6": "MP4",
+    b"mp41": "MP4", b"mp42": "MP4", b"avc1": "MP4",
+}
+
+EXIF_IFD_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+SUB_SEC_TIME_ORIGINAL = 0x9291
+CREATION_DATE_KEY = b"com.apple.quicktime.creationdate"
+
+XMP_DATE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})T(\d{2}:\d{2})(:\d{2})?(\S*)$")
+
+
+class UnsupportedFile(Exception):
+    """The file needs the full exiftool parser"""
+
+
+def file_modify_date(file_path: str) -> str:
+    """File:FileModifyDate as exiftool prints it: local time with the UTC offset"""
+    date = datetime.fromtimestamp(os.stat(file_path).st_mtime).astimezone()
+    offset = date.strftime("%z")
+    return date.strftime("%Y:%m:%d %H:%M:%S") + f"{offset[:3]}:{offset[3:]}"
+
+
+def _ascii(value: bytes) -> str:
+    return value.split(b"\x00", 1)[0].decode("ascii", "replace").strip()
+
+
+def parse_tiff(data: bytes) -> dict:
+    """The original date tags of a TIFF/EXIF block, keyed by tag id"""
+    if data[:4] == b"II*\x00":
+        endian = "<"
+    elif data[:4] == b"MM\x00*":
+        endian = ">"
+    else:
+        raise UnsupportedFile("Invalid TIFF header")
+
+    def read_ifd(offset: int) -> dict:
+        if offset + 2 > len(data):
+            raise UnsupportedFile("IFD outside of the EXIF block")
+        count = struct.unpack_from(endian + "H", data, offset)[0]
+        entries = {}
+        for index in range(count):
+            position = offset + 2 + index * 12
+            if position + 12 > len(data):
+                raise UnsupportedFile("Truncated IFD")
+            tag, kind, length = struct.unpack_from(endian + "HHI", data, position)
+            if kind == 2:
+                # ASCII, stored inline up to 4 bytes
+                if length <= 4:
+                    entries[tag] = data[position + 8:position + 8 + length]
+                else:
+                    value_offset = struct.unpack_from(endian + "I", data, position + 8)[0]
+                    entries[tag] = data[value_offset:value_offset + length]
+            elif kind in (4, 13) and length == 1:
+                entries[tag] = struct.unpack_from(endian + "I", data, position + 8)[0]
+        return entries
+
+    ifd0 = read_ifd(struct.unpack_from(endian + "I", data, 4)[0])
+    if EXIF_IFD_POINTER not in ifd0:
+        return {}
+
+    exif = read_ifd(ifd0[EXIF_IFD_POINTER])
+    return { tag: _ascii(value) for tag, value in exif.items() if isinstance(value, bytes) }
+
+
+def exif_dates(tags: dict) -> dict:
+    """EXIF:DateTimeOriginal and Composite:SubSecDateTimeOriginal built the way exiftool does"""
+    metadata = {}
+    if DATE_TIME_ORIGINAL not in tags:
+        return metadata
+
+    date = tags[DATE_TIME_ORIGINAL]
+    metadata["EXIF:DateTimeOriginal"] = date
+
+    sub_sec = tags.get(SUB_SEC_TIME_ORIGINAL)
+    offset = tags.get(OFFSET_TIME_ORIGINAL)
+    if sub_sec or offset:
+        composite = date
+        if sub_sec and sub_sec.isdigit():
+            composite += f".{sub_sec}"
+        if offset and re.match(r"^[-+]\d{2}:\d{2}$", offset):
+            composite += offset
+        metadata["Composite:SubSecDateTimeOriginal"] = composite
+
+    return metadata
+
+
+def read_jpeg(file) -> dict:
+    file.seek(2)
+    position = 2
+    while position < JPEG_HEADER_LIMIT:
+        header = file.read(2)
+        if len(header) < 2 or header[0] != 0xFF or header[1] == 0xFF:
+            # truncated, corrupt or padded with fill bytes...exiftool knows better
+            raise UnsupportedFile("Unexpected JPEG segment")
+        marker = header[1]
+        if marker in (0xD9, 0xDA):
+            # end of image or start of the compressed data, there is no EXIF block
+            return {}
+        length = struct.unpack(">H", file.read(2))[0]
+        if length < 2:
+            raise UnsupportedFile("Invalid JPEG segment length")
+        if marker == 0xE1:
+            segment = file.read(length - 2)
+            if segment.startswith(b"Exif\x00\x00"):
+                return exif_dates(parse_tiff(segment[6:]))
+        else:
+            file.seek(length - 2, os.SEEK_CUR)
+        position += 2 + length
+
+    raise UnsupportedFile("No image data in the JPEG header")
+
+
+def read_png(file) -> dict:
+    file.seek(8)
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            break
+        length, kind = struct.unpack(">I4s", header)
+        if kind == b"eXIf":
+            if length > PNG_CHUNK_LIMIT:
+                raise UnsupportedFile("EXIF chunk too big")
+            return exif_dates(parse_tiff(file.read(length)))
+        if kind == b"IEND":
+            break
+        file.seek(length + 4, os.SEEK_CUR)
+
+    # exiftool also finds EXIF in text chunks...leave the odd ones to it
+    raise UnsupportedFile("No eXIf chunk")
+
+
+def atoms(file, start: int, end: int):
+    """Yield (type, payload offset, payload size) of the atoms between start and end"""
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        header = file.read(8)
+        if len(header) < 8:
+            break
+        size, kind = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", file.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            raise UnsupportedFile("Invalid atom size")
+        yield kind, position + header_size, size - header_size
+        position += size
+
+
+def read_atom(file, offset: int, size: int) -> bytes:
+    if size > ATOM_READ_LIMIT:
+        raise UnsupportedFile("Atom too big")
+    file.seek(offset)
+    return file.read(size)
+
+
+def xmp_date(value: str) -> str:
+    """Convert an ISO 8601 date to the format exiftool prints"""
+    match = XMP_DATE.match(value)
+    if not match:
+        return value
+    year, month, day, hour_minute, seconds, rest = match.groups()
+    rest = re.sub(r"([-+]\d{2})(\d{2})$", r"\1:\2", rest)
+    return f"{year}:{month}:{day} {hour_minute}{seconds or ''}{rest}"
+
+
+def read_keys_meta(file, offset: int, size: int) -> dict:
+    """QuickTime:CreationDate from the keys/ilst items of a meta atom"""
+    # MP4 meta atoms carry a version and flags, QuickTime ones don't
+    if read_atom(file, offset, 4) == b"\x00\x00\x00\x00":
+        offset, size = offset + 4, size - 4
+
+    keys = []
+    items = None
+    for kind, item_offset, item_size in atoms(file, offset, offset + size):
+        if kind == b"keys":
+            data = read_atom(file, item_offset, item_size)
+            count = struct.unpack_from(">I", data, 4)[0]
+            position = 8
+            for _ in range(count):
+                key_size = struct.unpack_from(">I", data, position)[0]
+                keys.append(data[position + 8:position + key_size])
+                position += key_size
+        elif kind == b"ilst":
+            items = (item_offset, item_size)
+
+    if CREATION_DATE_KEY not in keys or items is None:
+        return {}
+
+    index = keys.index(CREATION_DATE_KEY) + 1
+    for kind, item_offset, item_size in atoms(file, items[0], items[0] + items[1]):
+        if struct.unpack(">I", kind)[0] != index:
+            continue
+        for data_kind, data_offset, data_size in atoms(file, item_offset, item_offset + item_size):
+            if data_kind == b"data":
+                value = read_atom(file, data_offset, data_size)[8:]
+                return { "QuickTime:CreationDate": xmp_date(value.decode("utf-8", "replace").strip("\x00")) }
+
+    return {}
+
+
+def read_quicktime(file, file_size: int) -> dict:
+    moov = None
+    for kind, offset, size in atoms(file, 0, file_size):
+        if kind == b"moov":
+            moov = (offset, size)
+            break
+    if moov is None:
+        raise UnsupportedFile("No moov atom")
+
+    metadata = {}
+    for kind, offset, size in atoms(file, moov[0], moov[0] + moov[1]):
+        if kind == b"mvhd":
+            data = read_atom(file, offset, min(size, 32))
+            if data[0] == 1:
+                seconds = struct.unpack_from(">Q", data, 4)[0]
+            else:
+                seconds = struct.unpack_from(">I", data, 4)[0]
+            if seconds:
+                # stored as UTC, exiftool prints it without converting to local time
+                date = QUICKTIME_EPOCH + timedelta(seconds=seconds)
+                metadata["QuickTime:CreateDate"] = date.strftime("%Y:%m:%d %H:%M:%S")
+            else:
+                metadata["QuickTime:CreateDate"] = "0000:00:00 00:00:00"
+        elif kind == b"meta":
+            metadata.update(read_keys_meta(file, offset, size))
+
+    if "QuickTime:CreateDate" not in metadata:
+        raise UnsupportedFile("No mvhd atom")
+    return metadata
+
+
+def read_metadata(file_path: str) -> dict:
+    """
+    Read the tags NameResolver needs straight from the file header, without exiftool
+
+    Returns the tags under the same names exiftool uses, or None when the file type isn't
+    supported or the file looks odd, in which case exiftool should be used instead.
+    """
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, "rb") as file:
+            head = file.read(12)
+            if head[:2] == b"\xff\xd8":
+                metadata = { "File:FileType": "JPEG", **read_jpeg(file) }
+            elif head[:8] == b"\x89PNG\r\n\x1a\n":
+                metadata = { "File:FileType": "PNG", **read_png(file) }
+            elif head[4:8] == b"ftyp" and head[8:12] in QUICKTIME_BRANDS:
+                metadata = { "File:FileType": QUICKTIME_BRANDS[head[8:12]], **read_quicktime(file, file_size) }
+            else:
+                return None
+        metadata["File:FileModifyDate"] = file_modify_date(file_path)
+        metadata["SourceFile"] = file_path
+        return metadata
+    except (UnsupportedFile, struct.error, IndexError, ValueError, OSError):
+        return None
+
+
+def compare(file_paths: list, exiftool_helper=None, chunk_size: int = 200) -> list:
+    """
+    Read the files natively and with exiftool, and return the tags they disagree on
+
+    Files the native reader leaves to exiftool are skipped. Each difference is a dict with the
+    file, the tag and both values.
+    """
+    import exiftool
+    from name_resolver import METADATA_TAGS
+
+    if exiftool_helper is None:
+        with exiftool.ExifToolHelper() as et:
+            return compare(file_paths, et, chunk_size)
+
+    differences = []
+    for start in range(0, len(file_paths), chunk_size):
+        chunk = file_paths[start:start + chunk_size]
+        expected = { result["SourceFile"]: result for result in exiftool_helper.get_tags(chunk, METADATA_TAGS) }
+        for file_path in chunk:
+            native = read_metadata(file_path)
+            if native is None:
+                continue
+            reference = expected.get(file_path, {})
+            for tag in METADATA_TAGS:
+                if native.get(tag) != reference.get(tag):
+                    differences.append({ "file": file_path, "tag": tag, "native": native.get(tag), "exiftool": reference.get(tag) })
+
+    return differences
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m fast_metadata",
+                                     description="Check the natively read dates against exiftool")
+    parser.add_argument("paths", nargs="+", help="sample files, or directories searched recursively")
+    args = parser.parse_args(argv)
+
+    file_paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            file_paths.extend(os.path.join(directory, name) for directory, _, names in os.walk(path) for name in names)
+        else:
+            file_paths.append(path)
+
+    try:
+        differences = compare(file_paths)
+    except FileNotFoundError as e:
+        print(f"ERROR: the comparison needs exiftool: {e}")
+        return 2
+    for difference in differences:
+        print(f"{difference['file']}: {difference['tag']} native {difference['native']!r}, exiftool {difference['exiftool']!r}")
+    print(f"Files: {len(file_paths)}, differences: {len(differences)}")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import suppress
+import errno
+import hashlib
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+# ioctl cloning a whole file on copy-on-write filesystems (btrfs, xfs, bcachefs...)
+FICLONE = 0x40049409
+COPY_CHUNK = 64 * 1024 * 1024
+
+# the kernel or the filesystem can't copy this way...not an error, the next method is tried
+UNSUPPORTED = { errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.ENOTSOCK }
+
+
+def reflink(source, target) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError as e:
+        if e.errno in UNSUPPORTED:
+            return False
+        raise
+
+
+def copy_range(source, target) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    while True:
+        try:
+            count = os.copy_file_range(source.fileno(), target.fileno(), COPY_CHUNK)
+        except OSError as e:
+            # only fall back if nothing was written yet
+            if copied == 0 and e.errno in UNSUPPORTED:
+                return False
+            raise
+        if count == 0:
+            return True
+        copied += count
+
+
+def send_file(source, target) -> bool:
+    if not hasattr(os, "sendfile"):
+        return False
+    offset = 0
+    while True:
+        try:
+            count = os.sendfile(target.fileno(), source.fileno(), offset, COPY_CHUNK)
+        except OSError as e:
+            if offset == 0 and e.errno in UNSUPPORTED:
+                return False
+            raise
+        if count == 0:
+            return True
+        offset += count
+
+
+def copy_file(source, target) -> str:
+    """Copy between two open files with the cheapest method available, returns the one used"""
+    if reflink(source, target):
+        return "reflink"
+    if copy_range(source, target):
+        return "copy_file_range"
+    if send_file(source, target):
+        return "sendfile"
+    shutil.copyfileobj(source, target, COPY_CHUNK)
+    return "read/write"
+
+
+class FileMover:
+    """
+    Moves files, copying them when the target is on another device
+
+    A rename is tried first. When it fails with EXDEV the file is copied in the kernel, using a
+    reflink, copy_file_range or sendfile, then the timestamps are copied, the data synced and
+    optionally verified, and only then is the source removed. Copies run on their own threads so
+    the caller can go on resolving names while large files are transferred.
+    """
+
+    def __init__(self, verify: bool = False, workers: int = 4, algorithm: str = "blake2b", chunk_size: int = 1048576):
+        self.verify = verify
+        self.workers = workers
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
+
+        self.copied = 0
+        self.methods = {}
+
+        self._lock = threading.Lock()
+        self._executor = None
+        # target -> copy in progress, a target isn't on disk until its copy is done
+        self._pending = {}
+
+    def _digest(self, file_path: str) -> str:
+        digest = hashlib.new(self.algorithm)
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(self.chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def copy_move(self, source: str, target: str):
+        """Move a file by copying it, the source is only removed once the copy is complete"""
+        # never overwrite, the target may have appeared since the caller checked
+        target_file = open(target, "xb")
+        try:
+            with open(source, "rb") as source_file, target_file:
+                method = copy_file(source_file, target_file)
+                target_file.flush()
+                os.fsync(target_file.fileno())
+            shutil.copystat(source, target)
+
+            if self.verify and self._digest(source) != self._digest(target):
+                raise OSError(errno.EIO, "Copy differs from the source", target)
+        except BaseException:
+            # the source is intact...don't leave a partial copy behind
+            with suppress(OSError):
+                os.unlink(target)
+            raise
+
+        os.unlink(source)
+        with self._lock:
+            self.copied += 1
+            self.methods[method] = self.methods.get(method, 0) + 1
+
+    def move(self, source: str, target: str):
+        """Move a file and wait for it, copying across devices"""
+        try:
+            os.rename(source, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            self.copy_move(source, target)
+
+    def submit(self, source: str, target: str) -> Future:
+        """
+        Move a file, returning a future done when it's in place
+
+        Renames happen right away and raise directly, copies across devices run in the background.
+        """
+        try:
+            os.rename(source, target)
+            future = Future()
+            future.set_result(target)
+            return future
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="copy")
+            future = self._executor.submit(self.copy_move, source, target)
+            self._pending[target] = future
+
+        def done(_):
+            with self._lock:
+                if self._pending.get(target) is future:
+                    del self._pending[target]
+        future.add_done_callback(done)
+        return future
+
+    def wait(self, target: str = None):
+        """Wait for the copy to target, or for every copy in progress"""
+        with self._lock:
+            futures = list(self._pending.values()) if target is None else [self._pending.get(target)]
+        futures = [future for future in futures if future is not None]
+        if futures:
+            wait(futures)
+
+    def shutdown(self):
+        """Wait for the copies in progress, the mover can still be used afterwards"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            self._pending.clear()
@@ -0,0 +1,214 @@
+from collections import Counter
+from contextlib import nullcontext
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+# latency buckets per doubling, percentiles are accurate to about 19%
+BUCKETS_PER_DOUBLING = 4
+
+
+class Histogram:
+    """Latencies in logarithmic buckets, constant memory however many are recorded"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = Counter()
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[math.floor(math.log2(max(seconds, 1e-9)) * BUCKETS_PER_DOUBLING)] += 1
+
+    def percentile(self, fraction: float) -> float:
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # upper bound of the bucket, never more than the slowest one seen
+                return min(2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "min": self.min or 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class Gauge:
+    """Samples of a level, like the length of a queue"""
+
+    def __init__(self):
+        self.samples = 0
+        self.total = 0
+        self.max = 0
+        self.last = 0
+
+    def add(self, value: int):
+        self.samples += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.last = value
+
+    def summary(self) -> dict:
+        return { "samples": self.samples, "mean": self.total / self.samples if self.samples else 0.0, "max": self.max }
+
+
+class _Stage:
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *_):
+        self.metrics.record(self.name, time.perf_counter() - self.started)
+
+
+class Instrumentation:
+    """
+    Time spent per pipeline stage, per-file latency, throughput and queue depths of a run
+
+    Stages are timed with `with metrics.stage("exiftool"): ...`, from any thread. When disabled
+    stage() returns a shared no-op context, so instrumented code costs nothing.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """Forget what was recorded and start timing a new run"""
+        with self._lock:
+            self.started = time.perf_counter()
+            self.finished = None
+            self.stages = {}
+            self.gauges = {}
+            self.outcomes = Counter()
+            self._found = {}
+
+    def stop(self):
+        with self._lock:
+            self.finished = time.perf_counter()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name)
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = Histogram()
+            histogram.add(seconds)
+
+    def gauge(self, name: str, value: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                gauge = self.gauges[name] = Gauge()
+            gauge.add(value)
+
+    def file_found(self, file_path: str):
+        if self.enabled:
+            with self._lock:
+                self._found[file_path] = time.perf_counter()
+
+    def file_done(self, file_path: str, outcome: str):
+        """Count the outcome and record the time since the scan found the file"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.outcomes[outcome] += 1
+            found = self._found.pop(file_path, None)
+        if found is not None:
+            self.record("file", time.perf_counter() - found)
+
+    def summary(self) -> dict:
+        with self._lock:
+            elapsed = (self.finished or time.perf_counter()) - self.started
+            files = sum(self.outcomes.values())
+            return {
+                "elapsed": elapsed,
+                "files": files,
+                "files_per_second": files / elapsed if elapsed > 0 else 0.0,
+                "outcomes": dict(self.outcomes),
+                "stages": { name: histogram.summary() for name, histogram in sorted(self.stages.items()) },
+                "gauges": { name: gauge.summary() for name, gauge in sorted(self.gauges.items()) },
+            }
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+_NO_STAGE = nullcontext()
+# shared by the components that were not given an Instrumentation
+DISABLED = Instrumentation(enabled=False)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread at a fixed interval
+
+    Unlike cProfile it sees the worker threads and barely slows them down. The dump is in the
+    collapsed stack format read by flamegraph.pl and speedscope: one "frame;frame;frame count" per line.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
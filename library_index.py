@@ -0,0 +1,208 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from duplicates import DuplicateDetector
+from result_cache import default_cache_path
+
+SCHEMA_VERSION = 1
+
+# where process_file moves the files it takes out of the library
+EXCLUDED_DIRECTORIES = ["invalid", "duplicates", "delete"]
+
+
+class LibraryIndex:
+    """
+    Persistent index of the files in a working directory by size and content digest
+
+    Building it only stats the files, digests are computed the first time two files share a size
+    and stored, so finding a copy of an incoming file anywhere in the library is a lookup by size
+    followed by at most a few digest comparisons.
+    """
+
+    def __init__(self, working_directory: str, path: str = None, duplicates: DuplicateDetector = None,
+                 commit_every: int = 1000):
+        self.working_directory = os.path.abspath(working_directory)
+        if path is None:
+            name = hashlib.blake2b(self.working_directory.encode(), digest_size=8).hexdigest()
+            path = default_cache_path(f"index-{name}.sqlite")
+        self.path = path
+        self.duplicates = duplicates or DuplicateDetector()
+        self.commit_every = commit_every
+
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pending_writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            version = f"{SCHEMA_VERSION}:{self.duplicates.algorithm}"
+            row = connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != version:
+                # digests from another version or algorithm can't be compared...start over
+                connection.execute("DROP TABLE IF EXISTS files")
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    sample TEXT,
+                    digest TEXT,
+                    generation INTEGER NOT NULL DEFAULT 0
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS files_size ON files (size)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _written(self, count: int = 1):
+        self._pending_writes += count
+        if self._pending_writes >= self.commit_every:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def indexed(self, file_path: str) -> bool:
+        """Whether the path belongs to the library, the directories files are moved out to don't"""
+        relative = os.path.relpath(os.path.abspath(file_path), self.working_directory)
+        if relative.startswith(os.pardir):
+            return False
+        return relative.split(os.sep, 1)[0] not in EXCLUDED_DIRECTORIES
+
+    def build(self):
+        """Bring the index up to date with the working directory, only changed files lose their digests"""
+        with self._lock:
+            connection = self._connect()
+            generation = connection.execute("SELECT COALESCE(MAX(generation), 0) + 1 FROM files").fetchone()[0]
+
+            pending = [self.working_directory]
+            while pending:
+                root = pending.pop()
+                try:
+                    with os.scandir(root) as entries:
+                        batch = []
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.indexed(entry.path):
+                                    pending.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                stat = entry.stat()
+                                batch.append((entry.path, stat.st_size, stat.st_mtime_ns, generation))
+                except OSError:
+                    continue
+
+                connection.executemany("""
+                    INSERT INTO files (path, size, mtime_ns, generation) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (path) DO UPDATE SET
+                        sample = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns THEN sample END,
+                        digest = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns THEN digest END,
+                        size = excluded.size,
+                        mtime_ns = excluded.mtime_ns,
+                        generation = excluded.generation
+                    """, batch)
+                self._written(len(batch))
+
+            # whatever wasn't seen is gone
+            connection.execute("DELETE FROM files WHERE generation != ?", (generation,))
+            connection.commit()
+            self._pending_writes = 0
+
+    def _stored_digest(self, path: str, column: str, compute) -> str:
+        with self._lock:
+            row = self._connect().execute(f"SELECT {column} FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] is not None:
+            return row[0]
+
+        # hashing happens outside the lock, other workers keep using the index meanwhile
+        value = compute(path)
+        with self._lock:
+            self._connect().execute(f"UPDATE files SET {column} = ? WHERE path = ?", (value, path))
+            self._written()
+        return value
+
+    def find_duplicate(self, file_path: str, ignore: set = None) -> str:
+        """Path of another library file with exactly the same content, or None"""
+        # the index holds absolute paths, ignore must too
+        file_path = os.path.abspath(file_path)
+        size = os.path.getsize(file_path)
+        with self._lock:
+            candidates = self._connect().execute(
+                "SELECT path, mtime_ns FROM files WHERE size = ? AND path != ?", (size, file_path)
+            ).fetchall()
+
+        for path, mtime_ns in candidates:
+            if ignore and path in ignore:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.remove(path)
+                continue
+            if os.path.samestat(stat, os.stat(file_path)):
+                # the same file under another name, a hard link or a differently spelled path
+                continue
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                # changed behind our back...index it again
+                self.add(path)
+                if stat.st_size != size:
+                    continue
+
+            if size > 2 * self.duplicates.sample_size and \
+                    self._stored_digest(path, "sample", self.duplicates.sample) != self.duplicates.sample(file_path):
+                continue
+            if self._stored_digest(path, "digest", self.duplicates.digest) == self.duplicates.digest(file_path):
+                return path
+
+        return None
+
+    def add(self, file_path: str):
+        file_path = os.path.abspath(file_path)
+        if not self.indexed(file_path):
+            return
+        stat = os.stat(file_path)
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                (file_path, stat.st_size, stat.st_mtime_ns)
+            )
+            self._written()
+
+    def remove(self, file_path: str):
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            self._connect().execute("DELETE FROM files WHERE path = ?", (file_path,))
+            self._written()
+
+    def move(self, source_path: str, target_path: str):
+        """Follow a file moved by the renamer, its digests stay valid"""
+        source_path, target_path = os.path.abspath(source_path), os.path.abspath(target_path)
+        with self._lock:
+            connection = self._connect()
+            if not self.indexed(target_path):
+                connection.execute("DELETE FROM files WHERE path = ?", (source_path,))
+            else:
+                connection.execute("DELETE FROM files WHERE path = ?", (target_path,))
+                updated = connection.execute(
+                    "UPDATE files SET path = ? WHERE path = ?", (target_path, source_path)
+                ).rowcount
+                if not updated:
+                    self.add(target_path)
+            self._written()
+
+    def flush(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._pending_writes = 0
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
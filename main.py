@@ -16,5 +16,5 @@ load_dotenv()
 # Run the app
 if __name__ == "__main__":
     root = tk.Tk()
-    app = PathPickerApp(root)
+    app = PathPickerApp(root, log_file=config.get("log_file"))
     root.mainloop()
@@ -1,24 +1,51 @@
 from config import SearchType
 from name_resolver import NameResolver
+from directory_config import DirectoryConfigs
+from directory_manager import DirectoryManager
+from duplicates import DuplicateDetector
+from exiftool_pool import ExifToolPool
+from file_mover import FileMover
+from instrumentation import Instrumentation, SamplingProfiler
+from library_index import LibraryIndex
+from plan import RenamePlan, apply_plan, rollback
+from result_cache import ResultCache
+from vision import VisionExtractor
 import os
-import filecmp
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import threading
+import queue
 
 default_directory_config = { "search": SearchType.Exif, "directory_pattern": "%Y/%Y-%m-%d", "file_pattern": "%Y%m%d_%H%M%S_%f" }
 
 class MediaRenamer:
     def __init__(self, simulate: bool = True, create_sub_directories: bool = False, special_directories: dict = {}, 
                 log_callback: callable = print, delete_empty_directories: bool = False, 
-                invalid_as_file_date: bool = False, apply_dst: bool = True):
+                invalid_as_file_date: bool = False, apply_dst: bool = True, batch_size: int = 200,
+                queue_size: int = 10000, flush_interval: float = 1.0,
+                use_cache: bool = True, cache_path: str = None, cache_max_entries: int = 1000000,
+                fast_metadata: bool = True,
+                vision_concurrency: int = 8, vision_requests_per_minute: int = None, vision_tokens_per_minute: int = None,
+                use_library_index: bool = False, index_path: str = None, plan_path: str = None,
+                copy_workers: int = 4, verify_copies: bool = False, progress_callback: callable = None,
+                metrics_path: str = None, profile_path: str = None):
         self.simulate = simulate
         self.create_sub_directories = create_sub_directories
         self.special_directories = special_directories
+        # validated and compiled once, the most specific special directory of a file wins
+        self.directory_configs = DirectoryConfigs(special_directories, default_directory_config)
         self.log = log_callback
+        # called with (event, file_path) from the worker threads: "found" when the scan finds a file,
+        # then one of "rename", "delete", "invalid", "duplicate", "skip" or "error" once it's handled
+        self.progress = progress_callback
         self.delete_empty_directories = delete_empty_directories
         self.invalid_as_file_date = invalid_as_file_date
         self.apply_dst = apply_dst
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.fast_metadata = fast_metadata
 
         self.renamed_files = []
         self.deleted_files = []
@@ -27,8 +54,81 @@ class MediaRenamer:
         self.skipped_files = []
         self.delete_directories = []
 
+        # guards the result lists, workers record into them concurrently
+        self._stats_lock = threading.Lock()
+        # striped locks serializing the exists/compare/rename sequence per target path
+        self._target_locks = [threading.Lock() for _ in range(64)]
+        # striped locks serializing the library index lookups of files with the same size
+        self._content_locks = [threading.Lock() for _ in range(64)]
+        # files moved during the current run where the streaming scan could pick them up again, and
+        # in simulations every planned target, as collisions are only found through them
+        self._produced_targets = {}
+        # the directories found by the running scan but not listed yet, None outside of a scan
+        self._unscanned = None
+        self._moved_sources = set()
+        # entry counts of the scanned directories and the directories known to exist
+        self.directories = DirectoryManager()
 
-    def process_file(self, entry: Path, working_directory: Path):
+        # size first, then sampled, then full content comparison of colliding files
+        self.duplicates = DuplicateDetector()
+        # library wide lookup of identical content, built when processing starts
+        self.use_library_index = use_library_index
+        self.index_path = index_path
+        self.library_index = None
+        # where the moves are written for a later apply_plan, only planned when simulating
+        self.plan_path = plan_path
+        self.plan = None
+
+        # time per stage, per-file latency and queue depths, written as JSON to metrics_path after each run
+        self.metrics = Instrumentation()
+        self.metrics_path = metrics_path
+        # stacks of all threads sampled during each run, for flame graphs
+        self.profile_path = profile_path
+
+        # renames, or copies when the target is on another mount, which run alongside the resolution
+        self.mover = FileMover(verify=verify_copies, workers=copy_workers)
+        # long-lived exiftool sessions shared by every resolver, started on demand
+        self.exiftool_pool = ExifToolPool()
+        # dates resolved by previous runs, unchanged files are not looked at again
+        self.cache = ResultCache(cache_path, max_entries=cache_max_entries) if use_cache else None
+        # image-mode batches are sent concurrently within the API quota, answers are cached by file content
+        self.vision = VisionExtractor(
+            cache=self.cache,
+            concurrency=vision_concurrency,
+            requests_per_minute=vision_requests_per_minute,
+            tokens_per_minute=vision_tokens_per_minute,
+            metrics=self.metrics
+        )
+
+
+    def _record(self, files: list, value):
+        with self._stats_lock:
+            files.append(value)
+
+    def _progress(self, event: str, file_path: str):
+        if event == "found":
+            self.metrics.file_found(file_path)
+        else:
+            self.metrics.file_done(file_path, event)
+        self.progress is not None and self.progress(event, file_path)
+
+    def _target_lock(self, target: str) -> threading.Lock:
+        return self._target_locks[hash(os.path.normcase(target)) % len(self._target_locks)]
+
+
+    def _content_lock(self, entry: Path):
+        if self.library_index is None:
+            return nullcontext()
+        # files with the same content have the same size
+        return self._content_locks[os.path.getsize(entry) % len(self._content_locks)]
+
+
+    def directory_config(self, entry: Path) -> dict:
+        return self.directory_configs.match(entry)
+
+
+    def process_file(self, entry: Path, working_directory: Path, resolver: NameResolver = None):
+        outcome = "error"
         try:
             if not entry.is_file():
                 self.log(f"ERROR: Not a file: {entry}")
@@ -37,23 +137,22 @@ class MediaRenamer:
                 self.log("ERROR: The file does not exist: " + entry)
                 return
             
-            directory_config = default_directory_config
-
-            for item, value in self.special_directories.items():
-                if entry.is_relative_to(Path(item)):
-                    directory_config = value
-                    break
-
-            resolver = NameResolver(
-                file_path=entry.as_posix(),
-                config=directory_config,
-                apply_dst=self.apply_dst
-            )
+            if resolver is None:
+                resolver = NameResolver(
+                    file_path=entry.as_posix(),
+                    config=self.directory_config(entry),
+                    apply_dst=self.apply_dst,
+                    exiftool_pool=self.exiftool_pool,
+                    vision=self.vision,
+                    fast_metadata=self.fast_metadata
+                )
 
-            try:
-                resolver.process()
-            except Exception as e:
-                self.log(f"ERROR: {e}")
+                try:
+                    resolver.process()
+                except Exception as e:
+                    self.log(f"ERROR: {e}")
+            elif resolver.error:
+                self.log(f"ERROR: {resolver.error}")
 
             target = None
 
@@ -62,10 +161,12 @@ class MediaRenamer:
                     resolver.from_creation_date()
                 else:
                     self.log(f"INVALID: {entry.as_posix()} -> {target}")
-                    self.invalid_files.append(entry.as_posix())
+                    self._record(self.invalid_files, entry.as_posix())
                     target = os.path.join(working_directory, "invalid", os.path.basename(entry.as_posix()))
+                    action, reason = "invalid", resolver.error or "no date found"
 
             if resolver.success:
+                action, reason = "rename", f"{resolver.source} date"
                 if self.create_sub_directories:
                     target = os.path.join(working_directory, resolver.suggested_directory, resolver.name)
                 else:
@@ -74,107 +175,396 @@ class MediaRenamer:
             # if the source and target are the same, skip...we're fine
             if entry.as_posix() == target:
                 self.log("SKIP: " + entry.as_posix())
-                self.skipped_files.append(entry.as_posix())
+                self._record(self.skipped_files, entry.as_posix())
+                outcome = "skip"
                 return
 
             # from here, the source and the target are in different locations
             
-            if os.path.exists(target):
-                # deal with duplicate file
-                if filecmp.cmp(entry.as_posix(), target):
-                    # it's exactly the same file...delete the source
-                    self.log(f"DELETE: {entry.as_posix()}")
-                    self.deleted_files.append(entry.as_posix())
-                    target_filename, target_extension = os.path.splitext(os.path.basename(target))
-                    target = os.path.join(working_directory, "delete", f"{target_filename}_{hash}{target_extension}")
-
-                    # not self.simulate and os.remove(entry.as_posix())
-                    # return
-                else:
-                    # it's a duplicate filename but the file contents are different...move to "duplicates" dir
-                    # calculate hash of file
-                    hash = hashlib.md5(open(entry.as_posix(), "rb").read()).hexdigest()
-                    target_filename, target_extension = os.path.splitext(os.path.basename(target))
-                    target = os.path.join(working_directory, "duplicates", f"{target_filename}_{hash}{target_extension}")
-                    self.log(f"DUPLICATE: {entry.as_posix()} = {target}")
-                    self.duplicate_files.append(target)
-
-            not self.simulate and os.makedirs(os.path.dirname(target), exist_ok=True)
-            self.log(f"RENAME: {os.path.relpath(entry.as_posix(), working_directory)} -> {os.path.relpath(target, working_directory)}")
-            not self.simulate and os.rename(entry.as_posix(), target)
-            self.renamed_files.append(entry.as_posix())
+            # identical files are looked up one at a time, or each would find the other and both be deleted
+            with self._content_lock(entry):
+                original = None
+                if self.library_index is not None:
+                    # files moved away in this run don't count, they're already handled
+                    with self.metrics.stage("find_duplicate"):
+                        original = self.library_index.find_duplicate(entry.as_posix(), ignore=self._moved_sources)
+                    if original == target:
+                        # the copy is the file at the target...the existing file check below deletes it
+                        original = None
+                    if original is not None:
+                        # the same content is already somewhere else in the library
+                        self.log(f"DELETE: {entry.as_posix()} = {original}")
+                        self._record(self.deleted_files, entry.as_posix())
+                        action, reason = "delete", f"same content as {original}"
+                        hash = self.duplicates.digest(entry.as_posix())
+                        target_filename, target_extension = os.path.splitext(os.path.basename(target))
+                        target = os.path.join(working_directory, "delete", f"{target_filename}_{hash}{target_extension}")
+
+                # another worker may resolve to the same target...hold its lock until the file is in place
+                with self._target_lock(target):
+                    existing = self._existing(target)
+                    if original is None and existing is not None:
+                        # deal with duplicate file
+                        with self.metrics.stage("compare"):
+                            same_content = self.duplicates.same_content(entry.as_posix(), existing)
+                        if same_content:
+                            # it's exactly the same file...delete the source
+                            self.log(f"DELETE: {entry.as_posix()}")
+                            self._record(self.deleted_files, entry.as_posix())
+                            action, reason = "delete", f"same content as {target}"
+                            hash = self.duplicates.digest(entry.as_posix())
+                            target_filename, target_extension = os.path.splitext(os.path.basename(target))
+                            target = os.path.join(working_directory, "delete", f"{target_filename}_{hash}{target_extension}")
+
+                            # not self.simulate and os.remove(entry.as_posix())
+                            # return
+                        else:
+                            # it's a duplicate filename but the file contents are different...move to "duplicates" dir
+                            # calculate hash of file
+                            hash = self.duplicates.digest(entry.as_posix())
+                            action, reason = "duplicate", f"{target} has different content"
+                            target_filename, target_extension = os.path.splitext(os.path.basename(target))
+                            target = os.path.join(working_directory, "duplicates", f"{target_filename}_{hash}{target_extension}")
+                            self.log(f"DUPLICATE: {entry.as_posix()} = {target}")
+                            self._record(self.duplicate_files, target)
+
+                    with self.metrics.stage("move"):
+                        self._move(entry.as_posix(), target, action, reason, working_directory)
+                    outcome = action
 
         except Exception as e:
             self.log(f"ERROR: {e}")
             return
+        finally:
+            self._progress(outcome, entry.as_posix())
 
     
-    def process_file_threadsafe(self, entry: Path, working_directory: Path):
+    def _existing(self, target: str) -> str:
+        """The file occupying target, in simulations the one that would have been moved there"""
+        # a file still being copied there must be complete before it's compared
+        self.mover.wait(target)
+        if os.path.exists(target):
+            return target
+        if self.simulate:
+            with self._stats_lock:
+                return self._produced_targets.get(target)
+        return None
+
+    def _reachable(self, target: str) -> bool:
+        """Whether the running scan may still list target, the caller holds _stats_lock"""
+        if self._unscanned is None:
+            return True
+        # the directories of the target that don't exist yet are created below a listed one...
+        # the scan only gets there through an ancestor still waiting to be listed
+        directory = os.path.dirname(target)
+        while True:
+            if directory in self._unscanned:
+                return True
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return False
+            directory = parent
+
+    def _move(self, source: str, target: str, action: str, reason: str, working_directory: Path):
+        self.log(f"RENAME: {os.path.relpath(source, working_directory)} -> {os.path.relpath(target, working_directory)}")
+        with self._stats_lock:
+            # targets in the part of the tree already scanned are forgotten, memory stays flat
+            if self.simulate or self._reachable(target):
+                self._produced_targets[target] = source
+        if self.plan is not None:
+            self.plan.add(source, target, action, reason)
+        if self.library_index is not None:
+            with self._stats_lock:
+                # compared with the absolute paths of the index
+                self._moved_sources.add(os.path.abspath(source))
+        self.directories.makedirs(os.path.dirname(target), self.simulate)
+        self.directories.moved(source, target)
+        if not self.simulate:
+            future = self.mover.submit(source, target)
+            future.add_done_callback(lambda future: self._move_done(future, source, target))
+        self._record(self.renamed_files, source)
+
+    def _move_done(self, future, source: str, target: str):
+        try:
+            future.result()
+        except Exception as e:
+            self.log(f"ERROR moving {source} -> {target}: {e}")
+            return
+        self._moved(source, target)
+
+    def _moved(self, source: str, target: str):
+        # keep the cache and the index in step with moves made when applying a plan
+        if self.cache is not None:
+            self.cache.move(source, target)
+        if self.library_index is not None:
+            self.library_index.move(source, target)
+
+    def apply_plan(self, plan_path: str = None, journal_path: str = None, batch_size: int = 500) -> dict:
+        """Execute a plan written by a previous run, resuming from its journal if it was interrupted"""
+        stats = apply_plan(plan_path or self.plan_path, journal_path, batch_size, log=self.log,
+                           move=self.mover.move, on_move=self._moved)
+        if self.cache is not None:
+            self.cache.flush()
+        if self.library_index is not None:
+            self.library_index.flush()
+        self.log(f"Plan applied: {stats}")
+        return stats
+
+    def rollback_plan(self, journal_path: str) -> int:
+        """Move the files of an applied plan back to where they were"""
+        restored = rollback(journal_path, log=self.log, move=self.mover.move, on_move=self._moved)
+        if self.cache is not None:
+            self.cache.flush()
+        self.log(f"Restored files: {restored}")
+        return restored
+
+    def process_file_threadsafe(self, entry: Path, working_directory: Path, resolver: NameResolver = None):
         """Wrapper method to ensure thread-safe processing"""
         try:
-            self.process_file(entry, working_directory)
+            self.process_file(entry, working_directory, resolver)
         except Exception as e:
             self.log(f"ERROR processing file {entry}: {e}")
 
+    def process_batch(self, file_paths: list, config: dict, working_directory: Path):
+        """Resolve a batch of files sharing the same directory config and rename them"""
+        with self.metrics.stage("resolve_batch"):
+            resolvers = NameResolver.resolve_many(
+                file_paths,
+                config,
+                apply_dst=self.apply_dst,
+                exiftool_pool=self.exiftool_pool,
+                chunk_size=self.batch_size,
+                cache=self.cache,
+                vision=self.vision,
+                fast_metadata=self.fast_metadata,
+                metrics=self.metrics
+            )
+
+        for resolver in resolvers:
+            self.process_file_threadsafe(Path(resolver.file_path), working_directory, resolver)
+
+    def scan_directory(self, current_directory: Path, recursive: bool = False, directories: list = None):
+        """Yield the files below current_directory as they are found, optionally collecting the sub-directories"""
+        pending = [os.fspath(current_directory)]
+        with self._stats_lock:
+            self._unscanned = set(pending)
+        while pending:
+            root = pending.pop()
+            try:
+                with os.scandir(root) as entries:
+                    entries = list(entries)
+            except OSError as e:
+                # an unreadable directory is skipped, the rest of the tree is still processed
+                self.log(f"ERROR scanning directory {root}: {e}")
+                with self._stats_lock:
+                    self._unscanned.discard(root)
+                continue
+            # counted before any of its files is moved out
+            self.directories.scanned(root, len(entries))
+            sub_directories = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+            with self._stats_lock:
+                # only forgotten once listed, files moved in before then may be in the listing
+                recursive and self._unscanned.update(sub_directories)
+                self._unscanned.discard(root)
+            for entry in entries:
+                if entry.is_file():
+                    with self._stats_lock:
+                        produced = entry.path in self._produced_targets
+                    # files moved by this run are already in place
+                    if not produced:
+                        yield entry.path
+
+            if not recursive:
+                break
+
+            for dir_path in sub_directories:
+                # Skip invalid and duplicates directories
+                if directories is not None and os.path.basename(dir_path) not in ["invalid", "duplicates"]:
+                    directories.append(dir_path)
+            pending.extend(reversed(sub_directories))
+
+    def _scan_to_queue(self, current_directory: Path, recursive: bool, files: queue.Queue, directories: list):
+        try:
+            for file_path in self.scan_directory(current_directory, recursive, directories):
+                # reported before a worker can take it, or its outcome could come first
+                self._progress("found", file_path)
+                files.put(file_path)
+        except Exception as e:
+            self.log(f"ERROR scanning directory {current_directory}: {e}")
+        finally:
+            files.put(None)
+
+    def open_library_index(self, working_directory: Path):
+        """Bring the library index of working_directory up to date, if enabled"""
+        if not self.use_library_index:
+            return
+        if self.library_index is None or self.library_index.working_directory != os.path.abspath(working_directory):
+            self.library_index = LibraryIndex(os.fspath(working_directory), self.index_path, self.duplicates)
+        self.log("Indexing library...")
+        self.library_index.build()
+
+    def process_files(self, file_paths: list, working_directory: Path, executor: ThreadPoolExecutor) -> list:
+        """
+        Submit the files to a long-lived executor, grouped in batches by directory config
+
+        Nothing is shut down afterwards, so the exiftool sessions, the vision loop and the caches stay
+        warm for the next files. Returns the futures of the batches.
+        """
+        pending = {}
+        for file_path in file_paths:
+            self._progress("found", file_path)
+            config = self.directory_config(Path(file_path))
+            pending.setdefault(id(config), (config, []))[1].append(file_path)
+
+        futures = []
+        for config, batch in pending.values():
+            for start in range(0, len(batch), self.batch_size):
+                chunk = batch[start:start + self.batch_size]
+                future = executor.submit(self.process_batch, chunk, config, working_directory)
+                future.add_done_callback(lambda future, chunk=chunk: self._batch_failed(future, chunk))
+                futures.append(future)
+        return futures
+
+    def _batch_failed(self, future, batch: list):
+        try:
+            future.result()
+        except Exception as e:
+            self.log(f"ERROR processing files: {e}")
+            for file_path in batch:
+                self._progress("error", file_path)
+
+    def close(self):
+        """Stop the processes and threads started by the runs and write the caches, all restart on demand"""
+        # stop the exiftool processes and the vision requests, they are restarted on the next run
+        self.exiftool_pool.shutdown()
+        self.vision.close()
+        # copies still running update the cache and the index when they finish
+        self.mover.shutdown()
+        if self.cache is not None:
+            self.cache.flush()
+        if self.library_index is not None:
+            self.library_index.flush()
+
+    def produced(self, file_path: str) -> bool:
+        """Whether file_path was moved there by this renamer since the run state was last cleared"""
+        with self._stats_lock:
+            return file_path in self._produced_targets
+
+    def clear_run_state(self):
+        """Forget the files handled so far: statistics, produced targets, digests and known directories"""
+        with self._stats_lock:
+            for files in [self.renamed_files, self.deleted_files, self.invalid_files, self.duplicate_files,
+                          self.skipped_files, self.delete_directories]:
+                files.clear()
+            self._produced_targets.clear()
+            self._moved_sources.clear()
+        self.duplicates.clear()
+        self.directories.clear()
+
     def process_directory(self, current_directory: Path, working_directory: Path, recursive: bool = False, max_workers: int = None):
         """
         Process directory with thread pool execution
+
+        Files are streamed from a background scan through a bounded queue into batches, so renaming
+        starts right away and memory use does not grow with the size of the tree.
         
         Args:
             current_directory: Directory to process
             working_directory: Base directory for file operations
             recursive: Whether to process subdirectories
-            max_workers: Maximum number of threads to use
+            max_workers: Maximum number of threads to use, defaults to the number of cores
         """
-        # Collect all files and directories first
-        all_files = []
+        max_workers = max_workers or os.cpu_count() or 1
+        self.exiftool_pool.size = max_workers
+        # moves that are made aren't planned, applying them later would find every source missing
+        self.plan = RenamePlan(self.plan_path) if self.plan_path and self.simulate else None
+        self.metrics.start()
+        profiler = SamplingProfiler() if self.profile_path else None
+        profiler is not None and profiler.start()
+
+        self.open_library_index(working_directory)
+
         all_directories = []
+        # bounded hand-off between the scanner and the workers...a full queue pauses the scan
+        files = queue.Queue(maxsize=self.queue_size)
+        scanner = threading.Thread(
+            target=self._scan_to_queue,
+            args=(current_directory, recursive, files, all_directories),
+            daemon=True
+        )
+        scanner.start()
 
-        # Walk through the directory tree
-        for root, dirs, files in os.walk(current_directory):
-                
-            # Collect files
-            for file in files:
-                file_path = os.path.join(root, file)
-                all_files.append(file_path)
-                
-            # Collect directories
-            if not recursive:
-                break
-            
-            for dir in dirs:
-                # Skip invalid and duplicates directories
-                if dir in ["invalid", "duplicates"]:
-                    continue
-                dir_path = os.path.join(root, dir)
-                all_directories.append(dir_path)
-
-        # Use ThreadPoolExecutor for parallel processing
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            # Submit all file processing tasks
-            future_to_file = {
-                executor.submit(self.process_file_threadsafe, Path(file_path), working_directory): file_path
-                for file_path in all_files
-            }
-
-            # Wait for all tasks to complete
-            for future in as_completed(future_to_file):
-                file_path = future_to_file[future]
-                try:
-                    future.result()
-                except Exception as e:
-                    self.log(f"ERROR processing file {file_path}: {e}")
+        # caps the batches queued or running in the executor
+        in_flight = threading.BoundedSemaphore(max_workers * 2)
+        running = 0
+
+        def batch_done(future, batch):
+            nonlocal running
+            with self._stats_lock:
+                running -= 1
+            in_flight.release()
+            self._batch_failed(future, batch)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                def submit(config, batch):
+                    nonlocal running
+                    in_flight.acquire()
+                    with self._stats_lock:
+                        running += 1
+                        self.metrics.gauge("batches_in_flight", running)
+                    future = executor.submit(self.process_batch, batch, config, working_directory)
+                    future.add_done_callback(lambda future: batch_done(future, batch))
+
+                # Group files sharing a directory config so their metadata is fetched in batches
+                pending = {}
+                while True:
+                    try:
+                        file_path = files.get(timeout=self.flush_interval)
+                        self.metrics.gauge("scan_queue", files.qsize())
+                    except queue.Empty:
+                        # the scan is slow...don't let the workers wait for full batches
+                        for config, batch in pending.values():
+                            submit(config, batch)
+                        pending.clear()
+                        continue
+
+                    if file_path is None:
+                        break
+
+                    config = self.directory_config(Path(file_path))
+                    batch = pending.setdefault(id(config), (config, []))[1]
+                    batch.append(file_path)
+                    if len(batch) >= self.batch_size:
+                        submit(config, pending.pop(id(config))[1])
+
+                for config, batch in pending.values():
+                    submit(config, batch)
+        finally:
+            self.close()
+            if self.plan is not None:
+                self.plan.close()
+                self.log(f"Plan written: {self.plan.count} moves to {self.plan.path}")
+            self.duplicates.clear()
+            self.metrics.stop()
+            if profiler is not None:
+                profiler.stop()
+                profiler.dump(self.profile_path)
+                self.log(f"Profile written to {self.profile_path}")
+            if self.metrics_path:
+                self.metrics.write(self.metrics_path)
+                self.log(f"Metrics written to {self.metrics_path}")
+            with self._stats_lock:
+                self._produced_targets.clear()
+                self._moved_sources.clear()
+                self._unscanned = None
 
         # Process directories for deletion if requested
         if self.delete_empty_directories:
-            for dir_path in all_directories:  # Process in reverse order
-                try:
-                    if not os.listdir(dir_path):
-                        self.delete_directories.append(dir_path)
-                        if not self.simulate:
-                            os.rmdir(dir_path)
-                except Exception as e:
-                    self.log(f"ERROR deleting empty directory {dir_path}: {e}")
+            # deepest first, so parents emptied by removing their children go too
+            for dir_path in self.directories.prune(all_directories, self.simulate, self.log):
+                self._record(self.delete_directories, dir_path)
+        self.directories.clear()
 
         # Log statistics
         self.log("Renamed files: " + str(len(self.renamed_files)))
@@ -183,4 +573,9 @@ class MediaRenamer:
         self.log("Duplicate files: " + str(len(self.duplicate_files)))
         self.log("Skipped files: " + str(len(self.skipped_files)))
         self.log("Deleted directories: " + str(len(self.delete_directories)))
+        if self.cache is not None:
+            self.log("Cached results used: " + str(self.cache.hits))
+        if self.mover.copied:
+            self.log("Copied across devices: " + str(self.mover.copied))
+        self.log(f"Files per second: {self.metrics.summary()['files_per_second']:.1f}")
         self.log("Total files: " + str(len(self.renamed_files) + len(self.deleted_files) + len(self.invalid_files) + len(self.duplicate_files) + len(self.skipped_files)))
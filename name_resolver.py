@@ -1,15 +1,36 @@
 import exiftool
+from exiftool_pool import ExifToolPool
+from fast_metadata import read_metadata
+from instrumentation import DISABLED, Instrumentation
+from result_cache import ResultCache
 from datetime import datetime, timedelta
-import base64
-import openai
 import os
 from config import SearchType
-from pdf2image import convert_from_path
-from io import BytesIO
+from vision import VisionExtractor, NO_DATE
 from zoneinfo import ZoneInfo
 
+# the only tags needed to resolve a name, requesting them explicitly keeps exiftool output small
+METADATA_TAGS = [
+    "Composite:SubSecDateTimeOriginal",
+    "EXIF:DateTimeOriginal",
+    "QuickTime:CreationDate",
+    "QuickTime:CreateDate",
+    "File:FileModifyDate",
+    "File:FileType",
+]
+
+_default_vision = None
+
+def default_vision() -> VisionExtractor:
+    """Uncached extractor used by resolvers that were not given one"""
+    global _default_vision
+    if _default_vision is None:
+        _default_vision = VisionExtractor()
+    return _default_vision
+
 class NameResolver:
-    def __init__(self, file_path: str, config: dict, timezone: str = 'UTC', apply_dst: bool = True):
+    def __init__(self, file_path: str, config: dict, timezone: str = 'UTC', apply_dst: bool = True, exiftool_pool: ExifToolPool = None,
+                 vision: VisionExtractor = None, fast_metadata: bool = True, metrics: Instrumentation = None):
         self.file_path = file_path
         self.date = None
         self.name = None
@@ -17,6 +38,12 @@ class NameResolver:
         self.config = config
         self.metadata = None
         self.apply_dst = apply_dst
+        self.exiftool_pool = exiftool_pool
+        self.vision = vision
+        self.fast_metadata = fast_metadata
+        self.metrics = metrics or DISABLED
+        self.error = None
+        self.source = None
 
     @property
     def success(self):
@@ -46,94 +73,58 @@ class NameResolver:
 
     def process(self):
         if self.config["search"] == SearchType.Image:
-            self.from_image()
+            with self.metrics.stage("from_image"):
+                self.from_image()
         elif self.config["search"] == SearchType.FileSystem:
-            self.from_creation_date()
+            with self.metrics.stage("from_creation_date"):
+                self.from_creation_date()
         else:
-            self.from_exif()
+            with self.metrics.stage("from_exif"):
+                self.from_exif()
 
     def from_image(self) -> str:
         """Extract dates from images or PDFs using GPT-4 Vision"""
         try:
-            if self.file_path.lower().endswith(".pdf"):
-                # Convert PDF to images
-                images = convert_from_path(self.file_path)
-
-                buffered = BytesIO()
-                images[0].save(buffered, format="JPEG")
-                image_data = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            else:
-                # For non-PDF files, process as image
-                with open(self.file_path, "rb") as image_file:
-                    image_data = base64.b64encode(image_file.read()).decode('utf-8')
-
-            analysis = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """
-You are a date extraction assistant. 
-You are very good at analyzing images and extracting date information from them. 
-
-IMPORTANT: Focus on the current year 2025. Be extra careful to distinguish between 2023 and 2025 and be very careful distinguishing 7 and 1.
-
-Instructions:
-1. First analyze the image orientation. The image might be rotated or upside down.
-2. Automatically rotate the image to the correct orientation before analyzing.
-3. Dates are usually on top of the image, before any description or details.
-4. Look for dates near fields labeled 'Data', 'Data e Hora', or 'Date'.
-5. The dates are usually in one of these formats: YYYY-MM-DD, YYYY/MM/DD, DD/MM/YYYY.
-6. Time is usually in the format HH:MM or HH:MM:SS.
-7. Always double check the dates to make sure they are correct. This needs to be very precise.
-8. If you can't find a date in the first orientation, try rotating the image 90 degrees and look again.
-9. If no date is visible after trying all orientations, return 'No date found'.
-10. The date can never be bigger than the date when the image was made (in the exif metadata).
-11. If no time is found, assume 00:00:00.
-
-Return the date in the format YYYYMMDD_HHMMSS with no other text."""
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """
-Analyze this image and extract any date information visible in the image. If the image is rotated, rotate it to the correct orientation first. 
-
-IMPORTANT: Pay extra attention to distinguish between 2023 and 2025. If you see a date that looks like 2023, double check if it might actually be 2025.
-
-Return the date in the format YYYYMMDD_HHMMSS with no other text. If no date is visible, return 'No date found'."""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": { "url": f"data:image/jpeg;base64,{image_data}" }
-                            }
-                        ]
-                    }
-                ]
-            )
-            
-            date_str = analysis.choices[0].message.content.strip()
-            
-            if date_str == "No date found":
-                raise Exception("No date found")
-                
-            self.date = self.parse_date(date_str, "%Y%m%d_%H%M%S")
-            self.format_name(self.date)
+            self.apply_vision((self.vision or default_vision()).extract(self.file_path, self.config.get("vision")))
         except Exception as e:
             print(f"Error processing image: {str(e)}")
             return None
 
 
+    def apply_vision(self, date_str: str):
+        if date_str == NO_DATE:
+            raise Exception(NO_DATE)
+            
+        self.date = self.parse_date(date_str, "%Y%m%d_%H%M%S")
+        self.source = "image"
+        self.format_name(self.date)
+
+
+    def get_metadata(self) -> list:
+        if self.fast_metadata:
+            with self.metrics.stage("read_metadata"):
+                metadata = read_metadata(self.file_path)
+            if metadata is not None:
+                return [metadata]
+
+        if self.exiftool_pool is not None:
+            with self.metrics.stage("exiftool"):
+                return self.exiftool_pool.get_tags(self.file_path, METADATA_TAGS)
+
+        with exiftool.ExifToolHelper() as et:
+            return et.get_tags(self.file_path, METADATA_TAGS)
+
+
     def from_exif(self):
-        self.metadata = exiftool.ExifToolHelper().get_metadata(self.file_path)
+        self.metadata = self.get_metadata()
 
         if len(self.metadata) > 1:
             raise ValueError(f"ERROR: Multiple metadata found for file: {self.file_path}")
 
-        metadata = self.metadata[0]
+        self.apply_exif(self.metadata[0])
+
 
+    def apply_exif(self, metadata: dict):
         if metadata["File:FileType"] in ["JPEG", "JPG", "PNG"]:
             if "Composite:SubSecDateTimeOriginal" in metadata:
                 self.date = self.parse_date(metadata["Composite:SubSecDateTimeOriginal"])
@@ -153,18 +144,157 @@ Return the date in the format YYYYMMDD_HHMMSS with no other text. If no date is
         else:
             raise Exception(f"Unsupported file type: {metadata['File:FileType']} {self.file_path}")
         
+        self.source = "exif"
         self.format_name(self.date)
 
 
     def from_creation_date(self):
-        self.metadata = exiftool.ExifToolHelper().get_metadata(self.file_path)
+        # batched resolution already fetched the file dates together with the EXIF tags
+        if not self.metadata:
+            self.metadata = self.get_metadata()
 
         if len(self.metadata) > 1:
             raise ValueError(f"ERROR: Multiple metadata found for file: {self.file_path}")
 
-        metadata = self.metadata[0]
+        self.apply_creation_date(self.metadata[0])
 
+
+    def apply_creation_date(self, metadata: dict):
         date = metadata["File:FileModifyDate"]
         
         self.date = self.parse_date(date)
+        self.source = "file_date"
         self.format_name(self.date)
+
+
+    def from_date(self, date: datetime, source: str):
+        """Use a date resolved earlier, e.g. by a previous run"""
+        self.date = date
+        self.source = source
+        self.format_name(self.date)
+
+
+    @classmethod
+    def resolve_many(cls, file_paths: list, config: dict, apply_dst: bool = True, exiftool_pool: ExifToolPool = None,
+                     chunk_size: int = 200, cache: ResultCache = None, vision: VisionExtractor = None,
+                     fast_metadata: bool = True, metrics: Instrumentation = None) -> list:
+        """
+        Resolve the names of many files sharing the same directory config
+
+        EXIF and file system lookups are batched so a single exiftool call returns the
+        metadata of up to chunk_size files, after the common JPEG/PNG/MP4/MOV files were read natively
+        when fast_metadata is set. Failures are stored in resolver.error instead of raised.
+        Files found in the cache are not looked at, newly resolved dates are added to it.
+        """
+        metrics = metrics or DISABLED
+        resolvers = [
+            cls(file_path, config, apply_dst=apply_dst, exiftool_pool=exiftool_pool, vision=vision,
+                fast_metadata=fast_metadata, metrics=metrics)
+            for file_path in file_paths
+        ]
+
+        unresolved = resolvers
+        # the daylight savings shift is part of the stored date
+        options = "dst" if apply_dst else "no_dst"
+        if cache is not None:
+            unresolved = []
+            for resolver in resolvers:
+                with metrics.stage("cache_get"):
+                    cached = cache.get(resolver.file_path, config["search"], options)
+                if cached is None:
+                    unresolved.append(resolver)
+                else:
+                    resolver.from_date(*cached)
+
+        cls._resolve_uncached(unresolved, config, exiftool_pool, chunk_size, vision, fast_metadata, metrics)
+
+        if cache is not None:
+            for resolver in unresolved:
+                if resolver.success:
+                    cache.put(resolver.file_path, config["search"], resolver.date, resolver.source, options)
+
+        return resolvers
+
+
+    @staticmethod
+    def _resolve_uncached(resolvers: list, config: dict, exiftool_pool: ExifToolPool, chunk_size: int,
+                          vision: VisionExtractor = None, fast_metadata: bool = True, metrics: Instrumentation = None):
+        metrics = metrics or DISABLED
+        if config["search"] == SearchType.Image:
+            # identical files in the batch share one vision request
+            with metrics.stage("vision_batch"):
+                results = (vision or default_vision()).extract_many(
+                    [resolver.file_path for resolver in resolvers],
+                    config.get("vision")
+                )
+            for resolver in resolvers:
+                try:
+                    if isinstance(results[resolver.file_path], Exception):
+                        raise results[resolver.file_path]
+                    resolver.apply_vision(results[resolver.file_path])
+                except Exception as e:
+                    resolver.error = str(e)
+            return
+
+        def apply(resolver: NameResolver, metadata: dict):
+            resolver.metadata = [metadata]
+            try:
+                if config["search"] == SearchType.FileSystem:
+                    resolver.apply_creation_date(metadata)
+                else:
+                    resolver.apply_exif(metadata)
+            except Exception as e:
+                resolver.error = str(e)
+
+        remaining = resolvers
+        if fast_metadata:
+            # the common file types are read natively, only the others need exiftool
+            remaining = []
+            for resolver in resolvers:
+                with metrics.stage("read_metadata"):
+                    metadata = read_metadata(resolver.file_path)
+                if metadata is None:
+                    remaining.append(resolver)
+                else:
+                    apply(resolver, metadata)
+
+        for start in range(0, len(remaining), chunk_size):
+            chunk = remaining[start:start + chunk_size]
+            try:
+                with metrics.stage("exiftool_batch"):
+                    metadata = NameResolver.get_metadata_many([resolver.file_path for resolver in chunk], exiftool_pool)
+            except Exception:
+                # one bad file fails the whole call, as does a dead or missing exiftool...
+                # resolve this chunk one file at a time, each resolver records its own error
+                for resolver in chunk:
+                    resolver.fast_metadata = False
+                    resolver.process_safe()
+                continue
+
+            for resolver in chunk:
+                if resolver.file_path not in metadata:
+                    resolver.error = f"No metadata found for file: {resolver.file_path}"
+                    continue
+                apply(resolver, metadata[resolver.file_path])
+
+
+    @staticmethod
+    def get_metadata_many(file_paths: list, exiftool_pool: ExifToolPool = None) -> dict:
+        if exiftool_pool is not None:
+            results = exiftool_pool.get_tags(file_paths, METADATA_TAGS)
+        else:
+            with exiftool.ExifToolHelper() as et:
+                results = et.get_tags(file_paths, METADATA_TAGS)
+
+        by_source = {result["SourceFile"]: result for result in results if "SourceFile" in result}
+        if not by_source and len(results) == len(file_paths):
+            return dict(zip(file_paths, results))
+
+        return by_source
+
+
+    def process_safe(self):
+        try:
+            self.process()
+        except Exception as e:
+            self.error = str(e)
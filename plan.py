@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+
+class RenamePlan:
+    """Append-only JSON lines file of planned moves: source, target, action and reason"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        # created right away, a run without moves still leaves a plan to apply
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "w", encoding="utf-8")
+
+    def add(self, source: str, target: str, action: str, reason: str = None):
+        line = json.dumps({ "source": source, "target": target, "action": action, "reason": reason })
+        with self._lock:
+            self._file.write(line + "\n")
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_lines(path: str):
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # a record cut short by a crash...everything before it is still valid
+                break
+
+
+class Journal:
+    """
+    Append-only record of the moves made while applying a plan
+
+    A "begin" record is synced before a batch is moved and a "done" record after, so after a
+    crash every move is either known to be done, known not to be started, or checkable on disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        self.started = set()
+        self.order = []
+        if os.path.exists(path):
+            for record in read_lines(path):
+                move = (record["source"], record["target"])
+                if record["op"] == "begin":
+                    if move not in self.started:
+                        self.order.append(move)
+                    self.started.add(move)
+                elif record["op"] == "done":
+                    self.done.add(move)
+                elif record["op"] == "undone":
+                    self.done.discard(move)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, op: str, source: str, target: str):
+        self._file.write(json.dumps({ "op": op, "source": source, "target": target }) + "\n")
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def apply_plan(plan_path: str, journal_path: str = None, batch_size: int = 500, log: callable = print,
+               move: callable = os.rename, on_move: callable = None) -> dict:
+    """
+    Execute the moves of a plan in batches, resuming after the moves a previous attempt finished
+
+    Moves whose source is gone or whose target is taken are reported and left alone, the plan
+    may be older than the files. Returns the number of files per outcome.
+    """
+    journal = Journal(journal_path or plan_path + ".journal")
+    stats = { "moved": 0, "resumed": 0, "missing": 0, "conflict": 0 }
+    created_directories = set()
+
+    def run(batch: list):
+        for source, target in batch:
+            journal.write("begin", source, target)
+        journal.sync()
+
+        for source, target in batch:
+            directory = os.path.dirname(target)
+            if directory not in created_directories:
+                os.makedirs(directory, exist_ok=True)
+                created_directories.add(directory)
+            move(source, target)
+            journal.write("done", source, target)
+            stats["moved"] += 1
+            log(f"RENAME: {source} -> {target}")
+            on_move and on_move(source, target)
+        journal.sync()
+
+    try:
+        batch = []
+        batch_targets = set()
+        for entry in read_lines(plan_path):
+            source, target = entry["source"], entry["target"]
+            if (source, target) in journal.done:
+                stats["resumed"] += 1
+                continue
+            if (source, target) in journal.started and not os.path.exists(source) and os.path.exists(target):
+                # moved right before the crash, the done record never made it to disk
+                journal.write("done", source, target)
+                stats["resumed"] += 1
+                continue
+            if not os.path.exists(source):
+                log(f"MISSING: {source}")
+                stats["missing"] += 1
+                continue
+            if os.path.exists(target) or target in batch_targets:
+                log(f"CONFLICT: {source} -> {target}")
+                stats["conflict"] += 1
+                continue
+
+            batch.append((source, target))
+            batch_targets.add(target)
+            if len(batch) >= batch_size:
+                run(batch)
+                batch = []
+                batch_targets.clear()
+
+        if batch:
+            run(batch)
+    finally:
+        journal.sync()
+        journal.close()
+
+    return stats
+
+
+def rollback(journal_path: str, log: callable = print, move: callable = os.rename, on_move: callable = None) -> int:
+    """Move every file of an applied, or partially applied, plan back where it came from"""
+    journal = Journal(journal_path)
+    restored = 0
+
+    try:
+        # undo in reverse order so chained moves unwind correctly
+        for source, target in reversed(journal.order):
+            if os.path.exists(source) or not os.path.exists(target):
+                # never moved, or already restored
+                continue
+            os.makedirs(os.path.dirname(source), exist_ok=True)
+            move(target, source)
+            journal.write("undone", source, target)
+            restored += 1
+            log(f"RESTORE: {target} -> {source}")
+            on_move and on_move(target, source)
+    finally:
+        journal.sync()
+        journal.close()
+
+    return restored
@@ -0,0 +1,155 @@
+from datetime import datetime
+from io import BytesIO
+import base64
+import re
+from typing import TYPE_CHECKING
+
+# Pillow, pdf2image and PyPDF2 are imported by the functions using them, runs that never look
+# at image contents don't pay for loading them
+if TYPE_CHECKING:
+    from PIL import Image
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# how images are prepared before being sent to the vision model, overridable per special directory
+# with a "vision" entry, e.g. { "search": SearchType.Image, ..., "vision": { "crop_top": 0.3 } }
+DEFAULT_PREPROCESS = {
+    # decode, orient and shrink the image instead of sending the original file
+    "preprocess": True,
+    # the model works on images of at most 2048 pixels, anything bigger is wasted upload
+    "max_dimension": 2048,
+    "jpeg_quality": 85,
+    # fraction of the top of the image to send first, the full image is only sent if no date is found there
+    "crop_top": None,
+    # PDFs: only the first page is rendered, at this resolution
+    "pdf_dpi": 150,
+    # PDFs: look for a date in the text of the first pdf_pages pages before rendering anything
+    "pdf_text": True,
+    "pdf_pages": 1,
+    # PDFs: fall back to the document creation date...off by default, for scans it's the scan date
+    "pdf_metadata": False,
+}
+
+# address space limit of the preprocessing worker processes in MB, pdftoppm inherits it
+DEFAULT_MEMORY_LIMIT = 2048
+
+# dates as printed on documents, optionally followed by a time
+DATE_PATTERNS = [
+    (re.compile(r"(?<!\d)(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:[ T,]+(\d{1,2}):(\d{2})(?::(\d{2}))?)?"), "ymd"),
+    (re.compile(r"(?<!\d)(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})(?:[ T,]+(\d{1,2}):(\d{2})(?::(\d{2}))?)?"), "dmy"),
+]
+DATE_LABEL = re.compile(r"\b(?:data e hora|data|date)\b\s*:?", re.IGNORECASE)
+
+
+def preprocess_options(options: dict = None) -> dict:
+    return { **DEFAULT_PREPROCESS, **(options or {}) }
+
+
+def limit_memory(megabytes: int):
+    """Process pool initializer capping the memory a worker can use"""
+    if megabytes and resource is not None:
+        limit = megabytes * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def find_date(text: str) -> str:
+    """First valid date in the text as YYYYMMDD_HHMMSS, preferring dates right after a date label"""
+    candidates = []
+    for label in DATE_LABEL.finditer(text):
+        candidates.append(text[label.end():label.end() + 40])
+    candidates.append(text)
+
+    for candidate in candidates:
+        for pattern, order in DATE_PATTERNS:
+            for match in pattern.finditer(candidate):
+                first, second, third, hour, minute, second_of_minute = match.groups()
+                year, month, day = (first, second, third) if order == "ymd" else (third, second, first)
+                try:
+                    date = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second_of_minute or 0))
+                except ValueError:
+                    continue
+                return date.strftime("%Y%m%d_%H%M%S")
+
+    return None
+
+
+def pdf_date(file_path: str, options: dict = None) -> str:
+    """Date from the PDF text layer, or its metadata if enabled, without rendering anything"""
+    from PyPDF2 import PdfReader
+
+    options = preprocess_options(options)
+    reader = PdfReader(file_path)
+
+    if options["pdf_text"]:
+        for page in reader.pages[:options["pdf_pages"]]:
+            date = find_date(page.extract_text() or "")
+            if date:
+                return date
+
+    if options["pdf_metadata"] and reader.metadata is not None and reader.metadata.creation_date is not None:
+        return reader.metadata.creation_date.strftime("%Y%m%d_%H%M%S")
+
+    return None
+
+
+def load_image(file_path: str, options: dict = None) -> "Image.Image":
+    from PIL import Image, ImageOps
+
+    if file_path.lower().endswith(".pdf"):
+        from pdf2image import convert_from_path
+        from PyPDF2 import PdfReader
+
+        options = preprocess_options(options)
+        dpi = options["pdf_dpi"]
+        if options["max_dimension"]:
+            # lower the resolution of big pages so they are not rendered beyond max_dimension
+            try:
+                box = PdfReader(file_path).pages[0].mediabox
+                longest = max(float(box.width), float(box.height))
+            except Exception:
+                # poppler renders files PyPDF2 can't read...keep the configured resolution
+                longest = 0
+            if longest > 0:
+                dpi = max(1, min(dpi, int(options["max_dimension"] * 72 / longest)))
+
+        # only the first page is sent...don't rasterize the others
+        images = convert_from_path(file_path, dpi=dpi, first_page=1, last_page=1)
+        return images[0]
+
+    image = Image.open(file_path)
+    # phones store the rotation in EXIF instead of rotating the pixels
+    return ImageOps.exif_transpose(image)
+
+
+def encode_jpeg(image: "Image.Image", quality: int) -> str:
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality, optimize=True)
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+
+def prepare_image(file_path: str, options: dict = None, crop: bool = False) -> str:
+    """
+    Base64 JPEG payload of the image, or of the first page for PDFs, sized for the vision model
+
+    Runs in a worker process, so it only takes and returns plain values.
+    """
+    from PIL import Image
+
+    options = preprocess_options(options)
+    image = load_image(file_path, options)
+
+    if crop and options["crop_top"]:
+        image = image.crop((0, 0, image.width, max(1, int(image.height * options["crop_top"]))))
+
+    max_dimension = options["max_dimension"]
+    if max_dimension and max(image.size) > max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    return encode_jpeg(image, options["jpeg_quality"])
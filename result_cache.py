@@ -0,0 +1,236 @@
+from datetime import datetime
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA_VERSION = 2
+
+
+def default_cache_path(name: str) -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "media_rename", name)
+
+
+def sample_digest(file_path: str, size: int, block_size: int = 65536) -> str:
+    """Cheap content fingerprint built from the size and the first and last blocks of the file"""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, "rb") as file:
+        digest.update(file.read(block_size))
+        if size > block_size:
+            file.seek(max(block_size, size - block_size))
+            digest.update(file.read(block_size))
+    return digest.hexdigest()
+
+
+def file_digest(file_path: str, chunk_size: int = 1048576) -> str:
+    """Digest of the whole file content, read in fixed-size chunks"""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of resolved dates, so unchanged files skip metadata extraction on the next run
+
+    Entries are keyed by path and only used while the file size and modification time (and
+    optionally a sample of its content) still match, and only by runs with the same search type
+    and the same options changing the resolved date. The least recently used entries are evicted
+    once the cache holds more than max_entries results.
+
+    Vision results are stored separately, keyed by the digest of the file content, so identical
+    files are only sent to the vision model once.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = 1000000, hash_content: bool = False, commit_every: int = 500):
+        self.path = path or default_cache_path("results.sqlite")
+        self.max_entries = max_entries
+        self.hash_content = hash_content
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pending_writes = 0
+        self._touched = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            if row is None or int(row[0]) != SCHEMA_VERSION:
+                # results written by another version can't be trusted...start over, but keep the vision
+                # answers, their table hasn't changed since the first version and they are paid for
+                connection.execute("DROP TABLE IF EXISTS results")
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    digest TEXT,
+                    search TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS vision_results (
+                    digest TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _digest(self, file_path: str, size: int) -> str:
+        return sample_digest(file_path, size) if self.hash_content else None
+
+    def get(self, file_path: str, search, options: str = "") -> tuple:
+        """Return the cached (date, source) of the file, or None if it is unknown or has changed"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT size, mtime_ns, digest, search, options, date, source FROM results WHERE path = ?", (file_path,)
+            ).fetchone()
+
+        if row is None:
+            self._missed()
+            return None
+
+        size, mtime_ns, digest, cached_search, cached_options, date, source = row
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            # the file changed since it was resolved
+            self.invalidate(file_path)
+            self._missed()
+            return None
+        if cached_search != search.name or cached_options != options or (self.hash_content and digest != self._digest(file_path, stat.st_size)):
+            self._missed()
+            return None
+
+        with self._lock:
+            self._touched[file_path] = time.time()
+            self.hits += 1
+        return datetime.fromisoformat(date), source
+
+    def _missed(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, file_path: str, search, date: datetime, source: str, options: str = ""):
+        try:
+            stat = os.stat(file_path)
+            digest = self._digest(file_path, stat.st_size)
+        except OSError:
+            return
+
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_path, stat.st_size, stat.st_mtime_ns, digest, search.name, options, date.isoformat(), source,
+                 time.time())
+            )
+            self._written()
+
+    def get_vision(self, digest: str, model: str) -> str:
+        """Return the raw vision answer for the file content, 'No date found' answers included"""
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT result FROM vision_results WHERE digest = ? AND model = ?", (digest, model)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE vision_results SET last_used = ? WHERE digest = ?", (time.time(), digest))
+            self._written()
+        return row[0]
+
+    def put_vision(self, digest: str, model: str, result: str):
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO vision_results VALUES (?, ?, ?, ?)", (digest, result, model, time.time())
+            )
+            # vision answers are expensive...don't wait for the next batch commit
+            self._commit()
+
+    def move(self, source_path: str, target_path: str):
+        """Follow a renamed file, a rename keeps its size and modification time"""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM results WHERE path = ?", (target_path,))
+            connection.execute("UPDATE results SET path = ? WHERE path = ?", (target_path, source_path))
+            self._touched.pop(source_path, None)
+            self._written()
+
+    def invalidate(self, file_path: str):
+        with self._lock:
+            self._connect().execute("DELETE FROM results WHERE path = ?", (file_path,))
+            self._touched.pop(file_path, None)
+            self._written()
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM results")
+            self._connection.execute("DELETE FROM vision_results")
+            self._touched.clear()
+            self._connection.commit()
+
+    def _written(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self.commit_every:
+            self._commit()
+
+    def _commit(self):
+        connection = self._connect()
+        if self._touched:
+            connection.executemany(
+                "UPDATE results SET last_used = ? WHERE path = ?",
+                [(last_used, path) for path, last_used in self._touched.items()]
+            )
+            self._touched.clear()
+        connection.commit()
+        self._pending_writes = 0
+
+    def _evict(self):
+        connection = self._connect()
+        for table, key in [("results", "path"), ("vision_results", "digest")]:
+            count = connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            if count > self.max_entries:
+                # drop the least recently used entries, leaving some headroom before the next eviction
+                excess = count - int(self.max_entries * 0.9)
+                connection.execute(
+                    f"DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM {table} ORDER BY last_used LIMIT ?)", (excess,)
+                )
+
+    def flush(self):
+        """Commit pending writes and enforce the size cap"""
+        with self._lock:
+            if self._connection is None:
+                return
+            self._commit()
+            self._evict()
+            self._connection.commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,163 @@
+"""
+Checks fast_metadata against crafted file headers, and against exiftool when it's installed
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from fast_metadata import read_metadata
+
+DATE = "2021:03:04 05:06:07"
+# seconds from 1904-01-01 to 2020-01-02 03:04:05, how QuickTime stores dates
+QUICKTIME_SECONDS = 3660779045
+
+
+def tiff(tags: dict, endian: str = "<") -> bytes:
+    """TIFF block holding the ASCII tags in its Exif IFD"""
+    header = (b"II*\x00" if endian == "<" else b"MM\x00*") + struct.pack(endian + "I", 8)
+    # IFD0 at 8 with the single Exif IFD pointer, the Exif IFD right after it at 26
+    ifd0 = struct.pack(endian + "HHHII", 1, 0x8769, 4, 1, 26) + struct.pack(endian + "I", 0)
+    data_offset = 26 + 2 + 12 * len(tags) + 4
+    ifd = struct.pack(endian + "H", len(tags))
+    data = b""
+    for tag, value in sorted(tags.items()):
+        raw = value.encode() + b"\x00"
+        if len(raw) <= 4:
+            ifd += struct.pack(endian + "HHI", tag, 2, len(raw)) + raw.ljust(4, b"\x00")
+        else:
+            ifd += struct.pack(endian + "HHII", tag, 2, len(raw), data_offset + len(data))
+            data += raw
+    return header + ifd0 + ifd + struct.pack(endian + "I", 0) + data
+
+
+def segment(marker: int, payload: bytes) -> bytes:
+    return bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def jpeg(exif: bytes = None, fill: bool = False) -> bytes:
+    data = b"\xff\xd8" + segment(0xE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00")
+    if fill:
+        # a fill byte before the marker, allowed by the standard
+        data += b"\xff"
+    if exif is not None:
+        data += segment(0xE1, b"Exif\x00\x00" + exif)
+    return data + segment(0xDA, b"\x00" * 10) + b"\x00" * 32 + b"\xff\xd9"
+
+
+def chunk(kind: bytes, payload: bytes) -> bytes:
+    # the CRC isn't checked
+    return struct.pack(">I", len(payload)) + kind + payload + b"\x00" * 4
+
+
+def png(exif: bytes = None) -> bytes:
+    data = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+    if exif is not None:
+        data += chunk(b"eXIf", exif)
+    return data + chunk(b"IDAT", b"\x00" * 16) + chunk(b"IEND", b"")
+
+
+def atom(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload) + 8) + kind + payload
+
+
+def mvhd(seconds: int, version: int = 0) -> bytes:
+    if version == 1:
+        times = struct.pack(">QQ", seconds, seconds)
+    else:
+        times = struct.pack(">II", seconds, seconds)
+    return atom(b"mvhd", bytes([version, 0, 0, 0]) + times + b"\x00" * 80)
+
+
+def apple_keys(creation_date: str, mp4: bool = False) -> bytes:
+    key = b"com.apple.quicktime.creationdate"
+    keys = atom(b"keys", b"\x00" * 4 + struct.pack(">I", 1) + struct.pack(">I", len(key) + 8) + b"mdta" + key)
+    value = atom(b"data", struct.pack(">II", 1, 0) + creation_date.encode())
+    ilst = atom(b"ilst", struct.pack(">I", len(value) + 8) + struct.pack(">I", 1) + value)
+    hdlr = atom(b"hdlr", b"\x00" * 8 + b"mdta" + b"\x00" * 13)
+    # MP4 meta atoms have a version and flags, QuickTime ones don't
+    return atom(b"meta", (b"\x00" * 4 if mp4 else b"") + hdlr + keys + ilst)
+
+
+def quicktime(brand: bytes, moov: bytes) -> bytes:
+    return atom(b"ftyp", brand + b"\x00" * 4 + brand) + atom(b"moov", moov) + atom(b"mdat", b"\x00" * 64)
+
+
+SAMPLES = {
+    "exif.jpg": (jpeg(tiff({ 0x9003: DATE })), { "File:FileType": "JPEG", "EXIF:DateTimeOriginal": DATE }),
+    "subsec.jpg": (jpeg(tiff({ 0x9003: DATE, 0x9291: "123", 0x9011: "+01:00" })), {
+        "File:FileType": "JPEG",
+        "EXIF:DateTimeOriginal": DATE,
+        "Composite:SubSecDateTimeOriginal": f"{DATE}.123+01:00",
+    }),
+    "big_endian.jpg": (jpeg(tiff({ 0x9003: DATE }, ">")), { "File:FileType": "JPEG", "EXIF:DateTimeOriginal": DATE }),
+    "no_exif.jpg": (jpeg(), { "File:FileType": "JPEG" }),
+    "fill_byte.jpg": (jpeg(tiff({ 0x9003: DATE }), fill=True), None),
+    "truncated.jpg": (jpeg(tiff({ 0x9003: DATE }))[:60], None),
+    "exif.png": (png(tiff({ 0x9003: DATE })), { "File:FileType": "PNG", "EXIF:DateTimeOriginal": DATE }),
+    "no_exif.png": (png(), None),
+    "keys.mov": (quicktime(b"qt  ", mvhd(QUICKTIME_SECONDS) + apple_keys("2020-01-02T04:04:05+0100")), {
+        "File:FileType": "MOV",
+        "QuickTime:CreateDate": "2020:01:02 03:04:05",
+        "QuickTime:CreationDate": "2020:01:02 04:04:05+01:00",
+    }),
+    "keys.mp4": (quicktime(b"isom", mvhd(QUICKTIME_SECONDS) + apple_keys("2020-01-02T04:04:05+0100", mp4=True)), {
+        "File:FileType": "MP4",
+        "QuickTime:CreateDate": "2020:01:02 03:04:05",
+        "QuickTime:CreationDate": "2020:01:02 04:04:05+01:00",
+    }),
+    "mvhd_v0.mp4": (quicktime(b"isom", mvhd(QUICKTIME_SECONDS)), {
+        "File:FileType": "MP4", "QuickTime:CreateDate": "2020:01:02 03:04:05",
+    }),
+    "mvhd_v1.mp4": (quicktime(b"mp42", mvhd(QUICKTIME_SECONDS, version=1)), {
+        "File:FileType": "MP4", "QuickTime:CreateDate": "2020:01:02 03:04:05",
+    }),
+    "zero.mov": (quicktime(b"qt  ", mvhd(0)), { "File:FileType": "MOV", "QuickTime:CreateDate": "0000:00:00 00:00:00" }),
+    "no_moov.mp4": (atom(b"ftyp", b"isom" + b"\x00" * 4) + atom(b"mdat", b"\x00" * 64), None),
+}
+
+
+class ReadMetadataTest(unittest.TestCase):
+    """Tags read from crafted headers, None where exiftool has to take over"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        for name, (data, _) in SAMPLES.items():
+            with open(os.path.join(cls.directory, name), "wb") as file:
+                file.write(data)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_samples(self):
+        for name, (_, expected) in SAMPLES.items():
+            with self.subTest(name):
+                file_path = os.path.join(self.directory, name)
+                metadata = read_metadata(file_path)
+                if expected is None:
+                    self.assertIsNone(metadata)
+                    continue
+                self.assertEqual(metadata.pop("SourceFile"), file_path)
+                self.assertRegex(metadata.pop("File:FileModifyDate"), r"^\d{4}:\d{2}:\d{2} \d{2}:\d{2}:\d{2}[-+]\d{2}:\d{2}$")
+                self.assertEqual(metadata, expected)
+
+    def test_unsupported(self):
+        file_path = os.path.join(self.directory, "notes.txt")
+        with open(file_path, "w") as file:
+            file.write("2021-03-04")
+        self.assertIsNone(read_metadata(file_path))
+
+    @unittest.skipUnless(shutil.which("exiftool"), "exiftool is not installed")
+    def test_same_as_exiftool(self):
+        from fast_metadata import compare
+
+        file_paths = [os.path.join(self.directory, name) for name in SAMPLES]
+        self.assertEqual(compare(file_paths), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,19 +2,74 @@ from pathlib import Path
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
+from collections import deque
+import queue
 import threading
+import time
 from media_renamer import MediaRenamer
 from config import config
 
+# lines kept in the log box, the full log goes to the log file
+LOG_LINES = 2000
+# how often the UI picks up the events of the workers, in milliseconds
+DRAIN_INTERVAL = 100
+# events handled per tick, the rest wait for the next one so the UI stays responsive
+DRAIN_LIMIT = 20000
+
+OUTCOMES = ["rename", "delete", "invalid", "duplicate", "skip", "error"]
+
+
+class Progress:
+    """Counts of the files found and handled, with the rate and the time left"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.found = 0
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, event: str):
+        if event == "found":
+            self.found += 1
+        elif event in self.counts:
+            self.counts[event] += 1
+
+    def rate(self) -> float:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> float:
+        # the scan may still be running, so this is the time left for the files found so far
+        rate = self.rate()
+        return (self.found - self.done) / rate if rate > 0 else None
+
+    def summary(self) -> str:
+        text = f"{self.done}/{self.found} files, {self.rate():.1f} files/s"
+        eta = self.eta()
+        if self.finished is None and eta is not None:
+            text += f", ETA {int(eta) // 60}:{int(eta) % 60:02d}"
+        counts = ", ".join(f"{event} {count}" for event, count in self.counts.items() if count)
+        return f"{text}   {counts}" if counts else text
+
 
 class PathPickerApp:
-    def __init__(self, root):
+    def __init__(self, root, log_file: str = None):
         self.root = root
         self.root.title("Path Picker with Logging")
         self.root.geometry("600x400")
         self.root.option_add("*Font", ("Noto Sans", 10))
 
+        # workers only ever put events here, the widgets are touched by the Tk thread alone
+        self.events = queue.SimpleQueue()
+        self.progress = Progress()
+        self.log_file = open(log_file, "a", encoding="utf-8") if log_file else None
+
         self.create_widgets()
+        self.root.after(DRAIN_INTERVAL, self.drain)
 
     def create_widgets(self):
         # Top frame
@@ -82,6 +137,15 @@ class PathPickerApp:
 
         frame.columnconfigure(0, weight=1)
 
+        # Progress
+        progress_frame = ttk.Frame(self.root, padding=(10, 0))
+        progress_frame.pack(fill="x", expand=False)
+
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="determinate")
+        self.progress_bar.pack(fill="x")
+        self.progress_label = ttk.Label(progress_frame, text="")
+        self.progress_label.pack(fill="x")
+
         # Log output
         log_frame = ttk.LabelFrame(self.root, text="Log Output", padding=10)
         log_frame.pack(fill="both", expand=True, padx=10, pady=(5, 10))
@@ -107,6 +171,7 @@ class PathPickerApp:
         self.log(f"Apply DST: {self.apply_dst_var.get()}")
 
     def process(self):
+        self.progress = Progress()
         # Run the real work in a background thread
         threading.Thread(target=self.run_process).start()
 
@@ -120,7 +185,8 @@ class PathPickerApp:
                 log_callback=self.log,
                 delete_empty_directories=self.remove_empty_dirs_var.get(),
                 invalid_as_file_date=self.invalid_as_file_date_var.get(),
-                apply_dst=self.apply_dst_var.get()
+                apply_dst=self.apply_dst_var.get(),
+                progress_callback=self.on_progress
             )
             
             # Process the directory
@@ -131,13 +197,56 @@ class PathPickerApp:
             )
         except Exception as e:
             self.log(f"ERROR: {e}")
+        self.events.put(("finished", None))
         self.log("Processing finished.")
 
     def log(self, message):
-        print(message)
+        # called from the worker threads
+        self.events.put(("log", message))
+
+    def on_progress(self, event, file_path):
+        # called from the worker threads
+        self.events.put(("progress", event))
+
+    def drain(self):
+        """Apply the events the workers queued since the last tick, in one go"""
+        lines = deque(maxlen=LOG_LINES)
+        progressed = False
+        for _ in range(DRAIN_LIMIT):
+            try:
+                kind, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "log":
+                lines.append(value)
+                if self.log_file is not None:
+                    self.log_file.write(value + "\n")
+            elif kind == "progress":
+                self.progress.add(value)
+                progressed = True
+            elif kind == "finished":
+                self.progress.finished = time.monotonic()
+                progressed = True
+
+        if lines:
+            self.show_lines(lines)
+            if self.log_file is not None:
+                self.log_file.flush()
+        if progressed:
+            self.show_progress()
+        self.root.after(DRAIN_INTERVAL, self.drain)
+
+    def show_lines(self, lines):
         self.log_box.configure(state='normal')
-        self.log_box.insert(tk.END, message + '\n')
+        self.log_box.insert(tk.END, "\n".join(lines) + "\n")
+        # keep only the last LOG_LINES lines, the widget gets slower the more it holds
+        excess = int(self.log_box.index("end-1c").split(".")[0]) - 1 - LOG_LINES
+        if excess > 0:
+            self.log_box.delete("1.0", f"{excess + 1}.0")
         self.log_box.see(tk.END)
         self.log_box.configure(state='disabled')
-        self.root.update_idletasks()
+
+    def show_progress(self):
+        self.progress_bar.configure(maximum=max(self.progress.found, 1), value=self.progress.done)
+        self.progress_label.configure(text=self.progress.summary())
 
@@ -0,0 +1,323 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import base64
+import inspect
+import multiprocessing
+import random
+import threading
+import time
+from instrumentation import DISABLED, Instrumentation
+from preprocess import DEFAULT_MEMORY_LIMIT, encode_jpeg, limit_memory, load_image, pdf_date, prepare_image, preprocess_options
+from result_cache import ResultCache, file_digest
+
+NO_DATE = "No date found"
+
+SYSTEM_PROMPT = """
+You are a date extraction assistant.
+You are very good at analyzing images and extracting date information from them.
+
+IMPORTANT: Focus on the current year 2025. Be extra careful to distinguish between 2023 and 2025 and be very careful distinguishing 7 and 1.
+
+Instructions:
+1. First analyze the image orientation. The image might be rotated or upside down.
+2. Automatically rotate the image to the correct orientation before analyzing.
+3. Dates are usually on top of the image, before any description or details.
+4. Look for dates near fields labeled 'Data', 'Data e Hora', or 'Date'.
+5. The dates are usually in one of these formats: YYYY-MM-DD, YYYY/MM/DD, DD/MM/YYYY.
+6. Time is usually in the format HH:MM or HH:MM:SS.
+7. Always double check the dates to make sure they are correct. This needs to be very precise.
+8. If you can't find a date in the first orientation, try rotating the image 90 degrees and look again.
+9. If no date is visible after trying all orientations, return 'No date found'.
+10. The date can never be bigger than the date when the image was made (in the exif metadata).
+11. If no time is found, assume 00:00:00.
+
+Return the date in the format YYYYMMDD_HHMMSS with no other text."""
+
+USER_PROMPT = """
+Analyze this image and extract any date information visible in the image. If the image is rotated, rotate it to the correct orientation first.
+
+IMPORTANT: Pay extra attention to distinguish between 2023 and 2025. If you see a date that looks like 2023, double check if it might actually be 2025.
+
+Return the date in the format YYYYMMDD_HHMMSS with no other text. If no date is visible, return 'No date found'."""
+
+
+def encode_image(file_path: str, options: dict = None) -> str:
+    """Base64 payload of the original file, or of the first page for PDFs"""
+    if file_path.lower().endswith(".pdf"):
+        return encode_jpeg(load_image(file_path, options), 75)
+
+    # For non-PDF files, process as image
+    with open(file_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+
+class RateLimiter:
+    """Token buckets limiting the requests and the tokens sent per minute"""
+
+    def __init__(self, requests_per_minute: int = None, tokens_per_minute: int = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute or 0
+        self._tokens = tokens_per_minute or 0
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests_per_minute and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            # a request bigger than the whole bucket only waits for a full bucket
+            tokens = min(tokens, self.tokens_per_minute)
+            if self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    async def acquire(self, tokens: int = 1):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # requests are let through one at a time, in arrival order
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= min(tokens, self.tokens_per_minute)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth another try"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError)) or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+class VisionExtractor:
+    """
+    Extracts dates from images or PDFs using GPT-4 Vision
+
+    Requests run concurrently on a background asyncio loop, limited by concurrency and by the
+    requests/tokens per minute quota, and are retried with exponential backoff on 429 and 5xx errors.
+    Answers are cached by the digest of the file content, 'No date found' included, and identical
+    files being extracted at the same time share a single request. Any object exposing
+    chat.completions.create like the openai clients (sync or async) can be passed as client, e.g. a
+    local stub.
+    """
+
+    def __init__(self, client=None, cache: ResultCache = None, model: str = "gpt-4o", concurrency: int = 8,
+                 requests_per_minute: int = None, tokens_per_minute: int = None, tokens_per_request: int = 1000,
+                 timeout: float = 60, max_retries: int = 5, backoff: float = 1.0, preprocess_workers: int = None,
+                 memory_limit: int = DEFAULT_MEMORY_LIMIT, metrics: Instrumentation = None):
+        self.client = client
+        self.cache = cache
+        self.model = model
+        self.concurrency = concurrency
+        self.tokens_per_request = tokens_per_request
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.preprocess_workers = preprocess_workers
+        self.memory_limit = memory_limit
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.metrics = metrics or DISABLED
+        self.requests = 0
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._async_client = None
+        self._process_pool = None
+        self._in_flight = {}
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._semaphore = asyncio.Semaphore(self.concurrency)
+                self._thread = threading.Thread(target=self._loop.run_forever, name="vision-requests", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def _client(self):
+        if self.client is not None:
+            return self.client
+        if self._async_client is None:
+            # only imported once a file actually needs the model
+            import openai
+            self._async_client = openai.AsyncOpenAI()
+        return self._async_client
+
+    async def _create(self, messages: list):
+        create = self._client().chat.completions.create
+        # openai.AsyncOpenAI wraps create in a plain function, it isn't recognized as a coroutine function
+        if self.client is None or asyncio.iscoroutinefunction(create):
+            return await create(model=self.model, messages=messages)
+        # blocking clients run on a thread so they don't stall the other requests
+        result = await asyncio.to_thread(create, model=self.model, messages=messages)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def request(self, image_data: str) -> str:
+        messages = [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": USER_PROMPT
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": { "url": f"data:image/jpeg;base64,{image_data}" }
+                    }
+                ]
+            }
+        ]
+
+        attempt = 0
+        while True:
+            with self.metrics.stage("rate_limit_wait"):
+                await self.limiter.acquire(self.tokens_per_request)
+            try:
+                async with self._semaphore:
+                    with self.metrics.stage("vision_request"):
+                        analysis = await asyncio.wait_for(self._create(messages), self.timeout)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+                attempt += 1
+
+        self.requests += 1
+        return analysis.choices[0].message.content.strip()
+
+    async def _run_in_pool(self, function, *args):
+        # decoding, resizing and rendering hold the GIL...do it in memory capped worker processes
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                self.preprocess_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=limit_memory,
+                initargs=(self.memory_limit,)
+            )
+        try:
+            with self.metrics.stage(function.__name__):
+                return await asyncio.get_running_loop().run_in_executor(self._process_pool, function, *args)
+        except BrokenProcessPool:
+            # a worker was killed, e.g. by the memory limit...start a fresh pool for the next file
+            self._process_pool = None
+            raise
+
+    async def _prepare(self, file_path: str, options: dict, crop: bool = False) -> str:
+        if not options["preprocess"]:
+            if file_path.lower().endswith(".pdf"):
+                return await self._run_in_pool(encode_image, file_path, options)
+            return await asyncio.to_thread(encode_image, file_path)
+
+        return await self._run_in_pool(prepare_image, file_path, options, crop)
+
+    async def _extract(self, file_path: str, digest: str, options: dict) -> str:
+        if self.cache is not None:
+            result = await asyncio.to_thread(self.cache.get_vision, digest, self.model)
+            if result is not None:
+                return result
+
+        if file_path.lower().endswith(".pdf") and (options["pdf_text"] or options["pdf_metadata"]):
+            # a date in the text layer saves rendering the page and the request
+            try:
+                result = await self._run_in_pool(pdf_date, file_path, options)
+            except Exception as e:
+                # PyPDF2 is stricter than poppler, e.g. about junk after the EOF marker...render the page
+                print(f"Error reading the text layer of {file_path}: {e}")
+                result = None
+            if result is not None:
+                return result
+
+        if options["preprocess"] and options["crop_top"]:
+            # dates are usually at the top, try the small crop before sending the whole image
+            result = await self.request(await self._prepare(file_path, options, crop=True))
+            if result == NO_DATE:
+                result = await self.request(await self._prepare(file_path, options))
+        else:
+            result = await self.request(await self._prepare(file_path, options))
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put_vision, digest, self.model, result)
+        return result
+
+    async def _extract_file(self, file_path: str, options: dict) -> str:
+        with self.metrics.stage("hash"):
+            digest = await asyncio.to_thread(file_digest, file_path)
+
+        # an identical file may be extracted right now...share its request
+        task = self._in_flight.get(digest)
+        if task is None:
+            task = asyncio.ensure_future(self._extract(file_path, digest, options))
+            self._in_flight[digest] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(digest, None))
+        return await asyncio.shield(task)
+
+    async def _extract_many(self, file_paths: list, options: dict) -> list:
+        return await asyncio.gather(*[self._extract_file(file_path, options) for file_path in file_paths], return_exceptions=True)
+
+    def extract_many(self, file_paths: list, options: dict = None) -> dict:
+        """
+        Return the answer, or the exception raised, for each file...identical files are sent once
+
+        options tune the image preprocessing, see preprocess.DEFAULT_PREPROCESS.
+        """
+        if not file_paths:
+            return {}
+        options = preprocess_options(options)
+        results = asyncio.run_coroutine_threadsafe(self._extract_many(file_paths, options), self._ensure_loop()).result()
+        return dict(zip(file_paths, results))
+
+    def extract(self, file_path: str, options: dict = None) -> str:
+        """Return the raw answer for the file: a YYYYMMDD_HHMMSS date or 'No date found'"""
+        result = self.extract_many([file_path], options)[file_path]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        """Stop the request loop, it is started again on the next extraction"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = self._semaphore = None
+        if loop is None:
+            return
+        if self._async_client is not None:
+            asyncio.run_coroutine_threadsafe(self._async_client.close(), loop).result()
+            self._async_client = None
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
+        # the limiter lock belongs to the stopped loop
+        self.limiter._lock = None
@@ -0,0 +1,302 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from library_index import EXCLUDED_DIRECTORIES
+from media_renamer import MediaRenamer
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+# seconds between the reports of a watcher that is never idle, each also forgets the handled files
+REPORT_INTERVAL = 60.0
+
+
+class Inotify:
+    """Minimal inotify binding over ctypes, Linux only"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.watches = {}
+
+    def add(self, directory: str):
+        wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), directory)
+        self.watches[wd] = directory
+
+    def read(self, timeout: float) -> list:
+        """(path, mask) of the events received within timeout seconds"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 20)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\x00")
+            offset += EVENT_HEADER.size + length
+
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                # the directory is gone, or no longer watched
+                self.watches.pop(wd, None)
+                continue
+            if directory is None and not mask & IN_Q_OVERFLOW:
+                continue
+            events.append((os.path.join(directory, os.fsdecode(name)) if name else directory, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Renames the files that appear in a directory, as they appear
+
+    New and written files are reported by inotify, or found by rescanning every poll_interval
+    seconds where inotify isn't available. A file is only processed once it was closed and its
+    size and modification time stayed the same for settle seconds, so files still being copied
+    are left alone. Ready files are handed to the same worker pool throughout, and the renamer
+    keeps its exiftool sessions and caches warm between events.
+    """
+
+    def __init__(self, renamer: MediaRenamer, directory: Path, working_directory: Path = None, recursive: bool = True,
+                 settle: float = 2.0, poll_interval: float = 5.0, use_inotify: bool = True, max_workers: int = None,
+                 open_timeout: float = 60.0):
+        self.renamer = renamer
+        self.directory = os.path.abspath(directory)
+        self.working_directory = os.path.abspath(working_directory or directory)
+        self.recursive = recursive
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # files created but never reported closed are processed once they've been stable this long
+        self.open_timeout = open_timeout
+
+        self.log = renamer.log
+        self._stop = threading.Event()
+        self._inotify = None
+        # path -> [size, mtime_ns, stable since, closed]
+        self._pending = {}
+        self._in_flight = set()
+        self._futures = []
+        self._completed = 0
+        self._reported = time.monotonic()
+        self._known = {}
+
+    def stop(self):
+        """Ask the watcher to finish, from a signal handler or another thread"""
+        self._stop.set()
+
+    def _excluded(self, path: str) -> bool:
+        # where the renamer puts the files it takes out of the library
+        relative = os.path.relpath(path, self.working_directory)
+        return not relative.startswith(os.pardir) and relative.split(os.sep, 1)[0] in EXCLUDED_DIRECTORIES
+
+    def _directories(self, root: str):
+        yield root
+        if not self.recursive:
+            return
+        for path, directories, _ in os.walk(root):
+            directories[:] = [name for name in directories if not self._excluded(os.path.join(path, name))]
+            for name in directories:
+                yield os.path.join(path, name)
+
+    def _files(self, root: str):
+        for directory in self._directories(root):
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file(follow_symlinks=False):
+                            yield entry.path
+            except OSError:
+                continue
+
+    def _watch(self, root: str):
+        for directory in self._directories(root):
+            try:
+                self._inotify.add(directory)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    self.log(f"ERROR: Too many directories to watch, raise fs.inotify.max_user_watches: {directory}")
+                elif e.errno != errno.ENOENT:
+                    self.log(f"ERROR watching {directory}: {e}")
+
+    def _add(self, path: str, closed: bool):
+        if path in self._in_flight or self._excluded(path) or self.renamer.produced(path):
+            return
+        entry = self._pending.get(path)
+        if entry is None:
+            # stat on the next tick, the file may still be moving in
+            self._pending[path] = [None, None, time.monotonic(), closed]
+        elif closed:
+            entry[3] = True
+
+    def _rescan(self):
+        """Compare the files with the last scan, new and changed ones become pending"""
+        known = {}
+        for path in self._files(self.directory):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            known[path] = (stat.st_size, stat.st_mtime_ns)
+            if self._known.get(path) != known[path]:
+                self._add(path, closed=True)
+        self._known = known
+
+    def _handle(self, events: list):
+        for path, mask in events:
+            if mask & IN_Q_OVERFLOW:
+                # events were lost...look at everything again
+                self.log("Event queue overflow, rescanning")
+                self._rescan()
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive and not self._excluded(path):
+                    # watch it first, then pick up what landed in it before the watch existed
+                    self._watch(path)
+                    for file_path in self._files(path):
+                        self._add(file_path, closed=True)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._add(path, closed=True)
+            elif mask & (IN_CREATE | IN_MODIFY):
+                self._add(path, closed=False)
+
+    def _ready(self) -> list:
+        """The pending files whose size and modification time stopped changing"""
+        now = time.monotonic()
+        ready = []
+        for path, entry in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # gone before it settled
+                del self._pending[path]
+                continue
+
+            if entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+                entry[0], entry[1], entry[2] = stat.st_size, stat.st_mtime_ns, now
+                continue
+            stable = now - entry[2]
+            if stable >= self.settle and (entry[3] or stable >= self.open_timeout):
+                del self._pending[path]
+                ready.append(path)
+        # in flight from now on, waiting for a worker included
+        self._in_flight.update(ready)
+        return ready
+
+    def _submit(self, executor: ThreadPoolExecutor, ready: list):
+        futures = self.renamer.process_files(ready, Path(self.working_directory), executor)
+
+        def done(_):
+            if all(future.done() for future in futures):
+                self._in_flight.difference_update(ready)
+        for future in futures:
+            future.add_done_callback(done)
+        self._futures.extend(futures)
+
+    def _collect(self):
+        """Drop the finished batches, then report and forget the handled files when idle or every REPORT_INTERVAL"""
+        running = [future for future in self._futures if not future.done()]
+        self._completed += len(self._futures) - len(running)
+        self._futures = running
+        if not self._completed or running and time.monotonic() - self._reported < REPORT_INTERVAL:
+            return
+
+        renamer = self.renamer
+        if renamer.cache is not None:
+            renamer.cache.flush()
+        if renamer.library_index is not None:
+            renamer.library_index.flush()
+        self.log(f"Processed files: {len(renamer.renamed_files) + len(renamer.skipped_files)}, "
+                 f"invalid: {len(renamer.invalid_files)}, duplicates: {len(renamer.duplicate_files)}")
+
+        # take in the files moved so far while their targets are still known, or they would be
+        # seen as new...targets still being written may be processed again, and skipped
+        if self._inotify is not None:
+            self._handle(self._inotify.read(0))
+        else:
+            self._rescan()
+        renamer.clear_run_state()
+        self._completed = 0
+        self._reported = time.monotonic()
+
+    def run(self):
+        """Watch until stop() is called, the files already in the directory are processed first"""
+        renamer = self.renamer
+        renamer.exiftool_pool.size = self.max_workers
+        renamer.open_library_index(Path(self.working_directory))
+
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                self.log(f"inotify is not available, polling every {self.poll_interval}s: {e}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                if self._inotify is not None:
+                    # watches first, so nothing written during the first scan is missed
+                    self._watch(self.directory)
+                    for path in self._files(self.directory):
+                        self._add(path, closed=True)
+                else:
+                    self._rescan()
+                self.log(f"Watching {self.directory}")
+
+                last_scan = time.monotonic()
+                ready = []
+                while not self._stop.is_set():
+                    timeout = min(self.settle, self.poll_interval) / 2
+                    if self._inotify is not None:
+                        self._handle(self._inotify.read(timeout))
+                    else:
+                        self._stop.wait(timeout)
+                        if time.monotonic() - last_scan >= self.poll_interval:
+                            self._rescan()
+                            last_scan = time.monotonic()
+
+                    ready.extend(self._ready())
+                    # while every worker is busy the ready files wait, and go out later as bigger batches
+                    if ready and len(self._futures) < self.max_workers:
+                        self._submit(executor, ready)
+                        ready = []
+                    self._collect()
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            renamer.close()
+            self.log("Stopped watching")